@@ -1,19 +1,52 @@
+import operator
 from collections import deque
 from io import TextIOWrapper
 from symtable import Symbol
-from typing import Dict, List, Optional, Tuple
-
-from consts import AddressType, SemanticErrorType, SymbolDataType, SymbolType
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from consts import (
+    MODE_CONST,
+    MODE_DIRECT,
+    MODE_INDIRECT,
+    MODE_NONE,
+    OP_ADD,
+    OP_ASSIGN,
+    OP_EQ,
+    OP_JP,
+    OP_JPF,
+    OP_LT,
+    OP_MULT,
+    OP_PRINT,
+    OP_SUB,
+    WORD_LIMIT,
+    AddressType,
+    SemanticErrorType,
+    SymbolDataType,
+    SymbolType,
+)
+from optimizer import (
+    Liveness,
+    has_unpatched_jump,
+    jump_target,
+    linear_scan,
+    live_intervals,
+    peephole,
+    remove_codes,
+    rename_locations,
+)
 from util import (
     Address,
     ArgDetails,
+    CallSiteDetails,
     Code,
     FunctionCallDetails,
     FunctionDetails,
     IfDetails,
     LoopDetails,
+    ProgramBlock,
     SymbolTable,
     SymbolTableItem, SemanticError,
+    operand,
 )
 
 
@@ -21,9 +54,20 @@ class CodeGenerator:
     INT_SIZE = 4
     STACK_POINTER_ADDRESS = Address(address="0", address_type=AddressType.IMMEDIATE)
     STACK_ADDRESS = Address(address="0", address_type=AddressType.INDIRECT)
+    # what the actions fail with on the semantic stack and tables some syntax
+    # errors leave behind, as the code generator does not recover from them
+    ACTION_ERRORS = (AttributeError, IndexError, KeyError, ValueError)
 
-    def __init__(self, pb_stream: TextIOWrapper, error_stream: TextIOWrapper, scanner):
+    def __init__(self, pb_stream: TextIOWrapper, error_stream: TextIOWrapper, scanner, stream_output=False):
         self.scanner = scanner
+        # write each function's code once it is generated instead of the
+        # whole program at the end; the peephole pass then runs per function
+        # and can not drop functions that are never called. pb_stream must
+        # then be seekable
+        self._stream_output = stream_output
+        self._program_ended = False
+        # end of the code start_program emits ahead of the functions
+        self._prologue_end = 0
         self._pb_stream = pb_stream
         self._error_stream = error_stream
         self.symbol_table = SymbolTable()
@@ -37,7 +81,13 @@ class CodeGenerator:
         self.scope = 0
         self.func: FunctionDetails = None
         self.func_map: Dict[str, FunctionDetails] = {}
-        self.pb = []
+        self.pb = ProgramBlock()
+        # locations of array elements
+        self.array_cells: Set[int] = set()
+        # sizes of the arrays declared, by their first cell
+        self.array_sizes: Dict[int, int] = {}
+        # every call emitted and not flushed yet, in the order of the code
+        self.call_sites: List[CallSiteDetails] = []
         self.loop_stack: List[LoopDetails] = []
         self.last_variable = ""
         self.last_operator = ""
@@ -48,14 +98,15 @@ class CodeGenerator:
         self._iterator_expression_lineno = 0
         self._semantic_errors = []
 
-    def __call__(self, action_symbol: str, token):
-        if self.iterator_expression_mode and action_symbol != "end_iterator_expression_mode":
-            self.loop_stack[-1].iterator_expression_pb.append((action_symbol, token))
+    def __call__(self, action: Callable, token):
+        if self.iterator_expression_mode and action != self.end_iterator_expression_mode:
+            self.loop_stack[-1].iterator_expression_pb.append((action, token))
             return
-        if action_symbol.startswith("check"):
-            getattr(self, action_symbol)(token)
-        else:
-            getattr(self, action_symbol)(token)
+        action(token)
+
+    def resolve_action(self, action_symbol: str) -> Callable:
+        """Bound method for an action symbol of the grammar, to be passed to ``__call__``."""
+        return getattr(self, action_symbol)
 
     def start_program(self, _):
         self.pb.append(
@@ -69,6 +120,10 @@ class CodeGenerator:
                 Address("", AddressType.UNKNOWN)
             )
         )
+        if self._stream_output:
+            # main is only known at the end, after its jump may have been flushed
+            self.pb.defer(1)
+        self._prologue_end = len(self.pb)
         f_details = FunctionDetails(
             name="output",
             data_type=SymbolDataType.VOID,
@@ -97,29 +152,47 @@ class CodeGenerator:
     def end_program(self, _):
         if not self._has_error:
             main_func = self.func_map["main"]
-            self.pb[1].a = self._jump_address_str(
+            flushed = self.pb.base > 0
+            if flushed:
+                self._peephole_since_flush(main_func)
+            self.pb.patch_jump(1, self._jump_operand(
                 Address(str(main_func.pb_idx), AddressType.CONST)
-            )
-            for i, p in enumerate(self.pb):
-                self._pb_stream.write(f"{i}\t{str(p)}\n")
+            ))
+            if flushed:
+                self.pb.close(self._pb_stream)
+            else:
+                peephole(self.pb, self.call_sites)
+                self.pb.write(self._pb_stream)
             self._error_stream.write("The input program is semantically correct")
         else:
+            if self._stream_output:
+                self._pb_stream.seek(0)
+                self._pb_stream.truncate()
             self._pb_stream.write("The code has not been generated.")
             semantic_errors_sorted = sorted(self._semantic_errors, key=lambda x: x.lineno)
             for err in semantic_errors_sorted:
                 self._error_stream.write(f"{err}\n")
+        self._program_ended = True
+
+    def close(self):
+        """Take back the code streamed to pb_stream if end_program was never
+        reached, as when the parser stops at an unexpected EOF, so the output
+        is empty then as it is without streaming."""
+        if self._stream_output and not self._program_ended:
+            self._pb_stream.seek(0)
+            self._pb_stream.truncate()
 
     def start_declaration(self, token):
         self.declaration = SymbolTableItem(scope=self.scope)
 
     def declaration_type(self, token):
-        if token[1].upper() not in SymbolDataType._member_names_:
+        if token.lexeme.upper() not in SymbolDataType._member_names_:
             return
-        self.declaration.data_type = SymbolDataType._member_map_[token[1].upper()]
+        self.declaration.data_type = SymbolDataType._member_map_[token.lexeme.upper()]
 
     def declaration_id(self, token):
         self.check_redeclaration(token)
-        self.declaration.lexeme = token[1]
+        self.declaration.lexeme = token.lexeme
 
     def declare_function(self, token):
         self.declaration.symbol_type = SymbolType.FUNCTION
@@ -129,7 +202,7 @@ class CodeGenerator:
         self.declaration.symbol_type = SymbolType.VARIABLE
         if self.declaration.data_type == SymbolDataType.VOID:
             self._handle_semantic_error(SemanticErrorType.VOID_TYPE, details={"ID": self.declaration.lexeme})
-        self.declaration.address = self._get_temp()
+        self.declaration.address = self._get_storage()
         self._add_code(
             self._create_assign_code(
                 Address("0", AddressType.CONST),
@@ -145,8 +218,11 @@ class CodeGenerator:
         pass
 
     def declare_array_length(self, token):
-        self.declaration.size = int(token[1])
-        self._reserve_for_array(int(token[1]))
+        self.declaration.size = int(token.lexeme)
+        self._reserve_for_array(int(token.lexeme))
+        first = int(self.declaration.address.address)
+        self.array_sizes[first] = self.declaration.size
+        self.array_cells.update(range(first, first + self.declaration.size * self.INT_SIZE, self.INT_SIZE))
 
     def end_var_declaration(self, token):
         self.symbol_table.append(self.declaration)
@@ -154,8 +230,8 @@ class CodeGenerator:
 
     def start_function_declaration(self, token):
         self.symbol_table.append(self.declaration)
-        return_address = self._get_temp()
-        return_value_address = self._get_temp()
+        return_address = self._get_storage()
+        return_value_address = self._get_storage()
         self.func = FunctionDetails(
             self.declaration.lexeme,
             self.declaration.data_type,
@@ -170,15 +246,15 @@ class CodeGenerator:
     def param_id(self, token):
         self.declaration = SymbolTableItem(
             scope=self.scope,
-            lexeme=token[1],
+            lexeme=token.lexeme,
             data_type=SymbolDataType.INT,
             symbol_type=SymbolType.VARIABLE,
-            address=self._get_temp(),
+            address=self._get_storage(),
             is_param=True,
         )
         self.func.args.append(
             ArgDetails(
-                name=token[1], arg_type=SymbolType.VARIABLE, address=self.declaration.address,
+                name=token.lexeme, arg_type=SymbolType.VARIABLE, address=self.declaration.address,
             )
         )
 
@@ -196,7 +272,7 @@ class CodeGenerator:
     def declared_param(self, token):
         self.declaration.is_param = True
         self.declaration.symbol_type = SymbolType.VARIABLE
-        self.declaration.address = self._get_temp()
+        self.declaration.address = self._get_storage()
         self.func.args.append(
             ArgDetails(
                 name=self.declaration.lexeme,
@@ -211,6 +287,7 @@ class CodeGenerator:
 
     def start_scope(self, token):
         self.scope += 1
+        self.symbol_table.start_scope(self.scope)
 
     def end_scope(self, token):
         self.symbol_table.pop_last_scope(self.scope)
@@ -230,30 +307,62 @@ class CodeGenerator:
                     func_details.return_address,
                 )
             )
+        if not self._has_error:
+            self._drop_dead_spills(func_details)
+            self._drop_dead_stores(func_details)
+            self._allocate_temps(func_details)
+            # main comes last, so its code goes out with end_program
+            if self._stream_output and func_details.name != "main":
+                self._peephole_since_flush(func_details)
+                self.pb.flush(self._pb_stream)
+                self.call_sites.clear()
+
+    def _peephole_since_flush(self, func: FunctionDetails):
+        """Run the peephole pass over the code generated since the last flush,
+        which ends with ``func``. Code ahead of ``func``, such as global
+        initialisers, is never run, as the prologue jumps straight to main.
+        """
+        start = max(self.pb.base, self._prologue_end)
+        entries = [func.pb_idx]
+        peephole(self.pb, func.call_sites, start, len(self.pb), entries)
+        func.pb_idx = entries[0]
 
     def break_loop(self, token):
         if len(self.loop_stack) == 0:
             self._handle_semantic_error(SemanticErrorType.BREAK, {})
             return
         self.loop_stack[-1].breaks_pb_idx.append(len(self.pb))
-        self.pb.append(None)
+        self._add_code(self._create_jp_code(Address("", AddressType.UNKNOWN)))
 
     def push_address(self, token):
-        self.last_variable = token[1]
-        symbol = self._get_symbol(token[1])
+        self.last_variable = token.lexeme
+        symbol = self._get_symbol(token.lexeme)
         if symbol is None:
             self._has_error = True
-            self._handle_semantic_error(SemanticErrorType.SCOPING, details={"ID": token[1]})
+            self._handle_semantic_error(SemanticErrorType.SCOPING, details={"ID": token.lexeme})
             symbol = self.__dummy_symbol()
         address = symbol.address
         self._push_stack(address, symbol.symbol_type)
 
     def push_const(self, token):
-        self._push_stack(Address(token[1], AddressType.CONST), SymbolType.VARIABLE)
+        self._push_stack(Address(token.lexeme, AddressType.CONST), SymbolType.VARIABLE)
 
     def array_index(self, token):
         idx, idx_type = self._pop_stack()
         ar_address, _ = self._pop_stack()
+        if idx.address_type == AddressType.CONST:
+            offset = int(idx.address) * self.INT_SIZE
+            # an index out of the array's bounds is left to run time rather
+            # than folded into a direct access to a neighbouring cell
+            if (ar_address.address_type == AddressType.CONST
+                    and 0 <= int(idx.address) < self.array_sizes.get(int(ar_address.address), 0)):
+                self._push_stack(Address(str(int(ar_address.address) + offset), AddressType.IMMEDIATE), idx_type)
+                return
+            tmp = self._get_temp()
+            self._add_code(self._create_add_code(ar_address, Address(str(offset), AddressType.CONST), tmp))
+            tmp.address_type = AddressType.INDIRECT
+            self._push_stack(tmp, idx_type)
+            return
         mul_tmp = self._get_temp()
         self._add_code(
             self._create_mult_code(
@@ -279,11 +388,14 @@ class CodeGenerator:
         )
 
     def comparison_op(self, token):
-        self.last_operator = token[1]
+        self.last_operator = token.lexeme
 
     def comparison(self, token):
         b, _ = self._pop_stack()
         a, _ = self._pop_stack()
+        operation = operator.eq if self.last_operator == "==" else operator.lt
+        if self._push_folded((a, b), lambda x, y: int(operation(x, y)), SymbolType.VARIABLE):
+            return
         tmp = self._get_temp()
         if self.last_operator == "==":
             self._add_code(self._create_eq_code(a, b, tmp))
@@ -300,25 +412,25 @@ class CodeGenerator:
         if_details: IfDetails = self.if_stack[-1]
         if_details.else_jp_pb_idx = len(self.pb)
         self._add_code(self._create_jp_code(Address("", AddressType.UNKNOWN)))
-        self.pb[if_details.condition_jpf_pb_idx].b = self._jump_address_str(Address(
+        self.pb.patch_jump(if_details.condition_jpf_pb_idx, self._jump_operand(Address(
             str(len(self.pb)), AddressType.CONST
-        ))
+        )))
 
     def end_if(self, _):
         self.if_stack.pop()
 
     def if_jpf(self, token):
-        self.pb[self.if_stack[-1].condition_jpf_pb_idx].b = self._jump_address_str(Address(
+        self.pb.patch_jump(self.if_stack[-1].condition_jpf_pb_idx, self._jump_operand(Address(
             str(len(self.pb)), AddressType.CONST
-        ))
+        )))
 
     def else_jp(self, token):
-        self.pb[self.if_stack[-1].else_jp_pb_idx].a = self._jump_address_str(Address(
+        self.pb.patch_jump(self.if_stack[-1].else_jp_pb_idx, self._jump_operand(Address(
             str(len(self.pb)), AddressType.CONST
-        ))
+        )))
 
     def arith_op(self, token):
-        self.arith_operator_stack.append(token[1])
+        self.arith_operator_stack.append(token.lexeme)
 
     def arith(self, token):
         op = self.arith_operator_stack.pop()
@@ -333,6 +445,8 @@ class CodeGenerator:
             })
             self._push_stack(self.__dummy_symbol().address, SymbolType.UNKNOWN)
             return
+        if self._push_folded((a, b), operator.add if op == "+" else operator.sub, a_symbol_type):
+            return
         tmp = self._get_temp()
         if op == "+":
             self._add_code(self._create_add_code(a, b, tmp))
@@ -352,16 +466,35 @@ class CodeGenerator:
             })
             self._push_stack(self.__dummy_symbol().address, SymbolType.UNKNOWN)
             return
+        if self._push_folded((a, b), operator.mul, a_symbol_type):
+            return
         tmp = self._get_temp()
         self._add_code(self._create_mult_code(a, b, tmp))
         self._push_stack(tmp, a_symbol_type)
 
     def negate(self, token):
         a, a_type = self._pop_stack()
+        if self._push_folded((a,), operator.neg, a_type):
+            return
         tmp = self._get_temp()
         self._add_code(self._create_sub_code(Address("0", AddressType.CONST), a, tmp))
         self._push_stack(tmp, a_type)
 
+    def _push_folded(self, operands, operation: Callable, symbol_type: SymbolType) -> bool:
+        """Push the result of ``operation`` as a constant if all ``operands``
+        are constants, in which case no code is needed.
+
+        A result that does not fit a word of the target machine is left to
+        be computed at run time.
+        """
+        if any(operand.address_type != AddressType.CONST for operand in operands):
+            return False
+        value = operation(*(int(operand.address) for operand in operands))
+        if not -WORD_LIMIT <= value < WORD_LIMIT:
+            return False
+        self._push_stack(Address(str(value), AddressType.CONST), symbol_type)
+        return True
+
     def pop_stack(self, _):
         self._pop_stack()
 
@@ -383,8 +516,8 @@ class CodeGenerator:
         loop_details: LoopDetails = self.loop_stack.pop()
         self._running_iterator_expression = True
         self._iterator_expression_lineno = loop_details.lineno
-        for action_symbol, token in loop_details.iterator_expression_pb:
-            self.__call__(action_symbol, token)
+        for action, token in loop_details.iterator_expression_pb:
+            self.__call__(action, token)
         self._running_iterator_expression = False
         self.pb.append(
             self._create_jp_code(
@@ -394,10 +527,10 @@ class CodeGenerator:
         loop_details.next_pb_idx = len(self.pb)
         next_address = Address(str(len(self.pb)), AddressType.CONST)
         for break_pb_idx in loop_details.breaks_pb_idx:
-            self.pb[break_pb_idx] = self._create_jp_code(next_address)
-        self.pb[loop_details.condition_jp_pb_idx].b = self._jump_address_str(
+            self.pb.patch_jump(break_pb_idx, self._jump_operand(next_address))
+        self.pb.patch_jump(loop_details.condition_jp_pb_idx, self._jump_operand(
             next_address
-        )
+        ))
 
     def save_for(self, _):
         self.loop_stack[-1].condition_jp_pb_idx = len(self.pb)
@@ -460,15 +593,18 @@ class CodeGenerator:
             )
             return
         ra = None
+        saves = []
         if self.func.name != "main":
             ra = self.func.return_address
-            self._save_in_stack(ra)
-        for symbol in self._get_this_scope_symbol():
-            if symbol.address.address_type != AddressType.CONST:
-                self._save_in_stack(symbol.address)
+            saves.append((ra, self._save_in_stack(ra)))
+        symbols = self.symbol_table.items
+        for i in self._get_this_scope_symbol():
+            symbol = symbols[i]
+            if self._is_spilled(symbol.address):
+                saves.append((symbol.address, self._save_in_stack(symbol.address)))
         for address in self.stack:
-            if address.address_type != AddressType.CONST:
-                self._save_in_stack(address)
+            if self._is_spilled(address):
+                saves.append((address, self._save_in_stack(address)))
         for arg_detail, call_arg_detail in zip(
                 call_details.function.args, call_details.args
         ):
@@ -479,6 +615,7 @@ class CodeGenerator:
                 )
             )
 
+        return_pb_idx = len(self.pb)
         self._add_code(
             self._create_assign_code(
                 Address(str(len(self.pb) + 2), AddressType.CONST),
@@ -486,6 +623,7 @@ class CodeGenerator:
             )
         )
 
+        jp_pb_idx = len(self.pb)
         self._add_code(
             self._create_jp_code(
                 Address(
@@ -494,15 +632,30 @@ class CodeGenerator:
             )
         )
 
+        restores = []
         for address in reversed(self.stack):
-            if address.address_type != AddressType.CONST:
-                self._restore_from_stack(address)
+            if self._is_spilled(address):
+                restores.append(self._restore_from_stack(address))
 
-        for symbol in reversed(self._get_this_scope_symbol()):
-            if symbol.address.address_type != AddressType.CONST:
-                self._restore_from_stack(symbol.address)
+        for i in reversed(self._get_this_scope_symbol()):
+            symbol = symbols[i]
+            if self._is_spilled(symbol.address):
+                restores.append(self._restore_from_stack(symbol.address))
         if self.func.name != "main":
-            self._restore_from_stack(ra)
+            restores.append(self._restore_from_stack(ra))
+        restores.reverse()
+        call_site = CallSiteDetails(
+            return_pb_idx,
+            jp_pb_idx,
+            len(self.pb),
+            [
+                (int(address.address), save, restore)
+                for (address, save), restore in zip(saves, restores)
+                if address.address_type != AddressType.UNKNOWN
+            ],
+        )
+        self.func.call_sites.append(call_site)
+        self.call_sites.append(call_site)
 
         if call_details.function.data_type != SymbolDataType.VOID:
             tmp = self._get_temp()
@@ -522,7 +675,18 @@ class CodeGenerator:
                 SymbolType.VARIABLE,
             )
 
-    def _restore_from_stack(self, address):
+    def _is_spilled(self, address: Address) -> bool:
+        """Whether the value at ``address`` is kept on the runtime stack across a call.
+
+        Constants need no saving, and an array element with a constant index
+        is read after the call, like one reached through a pointer.
+        """
+        if address.address_type == AddressType.CONST:
+            return False
+        return address.address_type != AddressType.IMMEDIATE or int(address.address) not in self.array_cells
+
+    def _restore_from_stack(self, address) -> int:
+        pb_idx = len(self.pb)
         self._add_code(
             self._create_sub_code(
                 self.STACK_POINTER_ADDRESS,
@@ -536,8 +700,10 @@ class CodeGenerator:
                 Address(address.address, address_type=AddressType.IMMEDIATE),
             )
         )
+        return pb_idx
 
-    def _save_in_stack(self, address):
+    def _save_in_stack(self, address) -> int:
+        pb_idx = len(self.pb)
         self._add_code(self._create_assign_code(
             Address(address=address.address, address_type=AddressType.IMMEDIATE), self.STACK_ADDRESS))
         self._add_code(
@@ -547,6 +713,133 @@ class CodeGenerator:
                 self.STACK_POINTER_ADDRESS,
             )
         )
+        return pb_idx
+
+    def _drop_dead_spills(self, func: FunctionDetails):
+        """Remove the save and restore of every value a call site of ``func``
+        keeps on the runtime stack although it is dead once the call returns,
+        or although the callee can not overwrite it.
+
+        Only the function's own locations are considered: its frame symbols and
+        the temporaries allocated since its return address, which nothing else
+        reads. A function only calls itself or functions declared before it,
+        which can not reach it, so just calls of ``func`` itself need them
+        saved. Dropping a save can leave values dead at earlier call sites, so
+        liveness is recomputed until nothing more is removed.
+        """
+        start, end = func.pb_idx, len(self.pb)
+        if has_unpatched_jump(self.pb, start, end):
+            return
+        first_private = int(func.return_address.address)
+        tracked = {}
+        for site in func.call_sites:
+            for location, _, _ in site.spills:
+                if first_private <= location < self.temp and location not in tracked:
+                    tracked[location] = len(tracked)
+        if not tracked:
+            return
+        calls = {site.jp_pb_idx for site in func.call_sites}
+        liveness = Liveness(self.pb, start, end, calls, tracked)
+        removed = set()
+        changed = True
+        while changed:
+            changed = False
+            live = liveness.live_in()
+            for site in func.call_sites:
+                live_after = 0
+                if self._calls_itself(func, site) and site.resume_pb_idx < end:
+                    live_after = live[site.resume_pb_idx - start]
+                for location, save, restore in site.spills:
+                    bit = tracked.get(location)
+                    if bit is None or save in removed or live_after >> bit & 1:
+                        continue
+                    for i in (save, save + 1, restore, restore + 1):
+                        removed.add(i)
+                        liveness.remove(i)
+                    changed = True
+        remove_codes(self.pb, start, removed, func.call_sites)
+
+    def _calls_itself(self, func: FunctionDetails, site: CallSiteDetails) -> bool:
+        return jump_target(self.pb, site.jp_pb_idx) == func.pb_idx
+
+    def _drop_dead_stores(self, func: FunctionDetails):
+        """Remove the instructions of ``func`` that only compute a temporary
+        nothing reads afterwards, such as the result of a call made for its
+        side effects, found by liveness over the function's control flow
+        graph. Removing one can leave the temporaries it read dead as well,
+        so this is repeated until nothing more is removed.
+
+        Restores of spilled values are left to _drop_dead_spills, and a
+        temporary live when a call of ``func`` itself returns keeps every
+        store, as the callee may be the one writing it.
+        """
+        start, end = func.pb_idx, len(self.pb)
+        if not func.temps or has_unpatched_jump(self.pb, start, end):
+            return
+        tracked = {location: bit for bit, location in enumerate(func.temps)}
+        calls = {site.jp_pb_idx for site in func.call_sites}
+        restores = {restore + 1 for site in func.call_sites for _, _, restore in site.spills}
+        liveness = Liveness(self.pb, start, end, calls, tracked)
+        removed = set()
+        changed = True
+        while changed:
+            changed = False
+            live = liveness.live_in()
+            pinned = self._live_across_self_calls(func, live, start, end)
+            for i in range(start, end):
+                written = liveness.kills[i - start]
+                if not written or written & pinned or i in restores:
+                    continue
+                if not liveness.live_out(live, i) & written:
+                    removed.add(i)
+                    liveness.remove(i)
+                    changed = True
+        remove_codes(self.pb, start, removed, func.call_sites)
+
+    def _live_across_self_calls(self, func: FunctionDetails, live: List[int], start: int, end: int) -> int:
+        """Tracked bits live, per ``live``, when a call of ``func`` itself returns."""
+        bits = 0
+        for site in func.call_sites:
+            if self._calls_itself(func, site) and site.jp_pb_idx + 1 < end:
+                bits |= live[site.jp_pb_idx + 1 - start]
+        return bits
+
+    def _allocate_temps(self, func: FunctionDetails):
+        """Move the temporaries of ``func`` into as few of their locations as
+        their live intervals allow, lowest first, and give the locations left
+        free at the top back to _get_storage.
+
+        A temporary still live when a call of ``func`` itself returns, and not
+        restored by it, keeps its location to itself, as the callee may run
+        the code that writes it.
+        """
+        start, end = func.pb_idx, len(self.pb)
+        if not func.temps or has_unpatched_jump(self.pb, start, end):
+            return
+        tracked = {location: bit for bit, location in enumerate(func.temps)}
+        calls = {site.jp_pb_idx for site in func.call_sites}
+        liveness = Liveness(self.pb, start, end, calls, tracked)
+        live = liveness.live_in()
+        pinned = self._live_across_self_calls(func, live, start, end)
+        intervals = {
+            func.temps[bit]: interval
+            for bit, interval in live_intervals(liveness, live).items()
+            if not pinned >> bit & 1
+        }
+        slots = [location for bit, location in enumerate(func.temps) if not pinned >> bit & 1]
+        assignment = linear_scan(intervals, slots)
+        renamed = {location: slot for location, slot in assignment.items() if location != slot}
+        rename_locations(self.pb, start, end, renamed)
+        for site in func.call_sites:
+            site.spills = [
+                (renamed.get(location, location), save, restore)
+                for location, save, restore in site.spills
+            ]
+        in_use = set(assignment.values())
+        in_use.update(location for bit, location in enumerate(func.temps) if pinned >> bit & 1)
+        free = set(func.temps) - in_use
+        while self.temp - self.INT_SIZE in free:
+            self.temp -= self.INT_SIZE
 
     def check_array(self, token):
         return self._get_symbol(self.last_variable).symbol_type == SymbolType.ARRAY
@@ -580,17 +873,24 @@ class CodeGenerator:
         return self.func_stack[-1].data_type != SymbolDataType.VOID
 
     def check_redeclaration(self, token):
-        last = self.symbol_table.get_last_by_lexeme(token[1])
+        last = self.symbol_table.get_last_by_lexeme(token.lexeme)
         if last == None or last.scope != self.scope:
             return
         "handle this"
 
-    def _get_temp(self):
+    def _get_storage(self):
         self.temp += self.INT_SIZE
         return Address(
             str(self.temp - self.INT_SIZE), address_type=AddressType.IMMEDIATE
         )
 
+    def _get_temp(self):
+        """A word for an intermediate value; the function's temporaries get
+        their final locations in _allocate_temps."""
+        address = self._get_storage()
+        self.func.temps.append(int(address.address))
+        return address
+
     def _reserve_for_array(self, size):
         self.temp += (size - 1) * self.INT_SIZE
 
@@ -599,59 +899,59 @@ class CodeGenerator:
 
     def _create_add_code(self, a: Address, b: Address, res: Address):
         return Code(
-            "ADD",
-            self._non_jump_address_str(a),
-            self._non_jump_address_str(b),
-            self._non_jump_address_str(res),
+            OP_ADD,
+            self._non_jump_operand(a),
+            self._non_jump_operand(b),
+            self._non_jump_operand(res),
         )
 
     def _create_sub_code(self, a: Address, b: Address, res: Address):
         return Code(
-            "SUB",
-            self._non_jump_address_str(a),
-            self._non_jump_address_str(b),
-            self._non_jump_address_str(res),
+            OP_SUB,
+            self._non_jump_operand(a),
+            self._non_jump_operand(b),
+            self._non_jump_operand(res),
         )
 
     def _create_assign_code(self, a: Address, r: Address):
         return Code(
-            "ASSIGN",
-            self._non_jump_address_str(a),
-            self._non_jump_address_str(r),
+            OP_ASSIGN,
+            self._non_jump_operand(a),
+            self._non_jump_operand(r),
         )
 
     def _create_jp_code(self, a: Address):
-        return Code("JP", self._jump_address_str(a))
+        return Code(OP_JP, self._jump_operand(a))
 
     def _create_jpf_code(self, a: Address, l: Address):
-        return Code("JPF", self._non_jump_address_str(a), self._jump_address_str(l))
+        return Code(OP_JPF, self._non_jump_operand(a), self._jump_operand(l))
 
     def _create_mult_code(self, a: Address, b: Address, res: Address):
         return Code(
-            "MULT",
-            self._non_jump_address_str(a),
-            self._non_jump_address_str(b),
-            self._non_jump_address_str(res),
+            OP_MULT,
+            self._non_jump_operand(a),
+            self._non_jump_operand(b),
+            self._non_jump_operand(res),
         )
 
     def _create_eq_code(self, a: Address, b: Address, res: Address):
         return Code(
-            "EQ",
-            self._non_jump_address_str(a),
-            self._non_jump_address_str(b),
-            self._non_jump_address_str(res),
+            OP_EQ,
+            self._non_jump_operand(a),
+            self._non_jump_operand(b),
+            self._non_jump_operand(res),
         )
 
     def _create_lt_code(self, a: Address, b: Address, res: Address):
         return Code(
-            "LT",
-            self._non_jump_address_str(a),
-            self._non_jump_address_str(b),
-            self._non_jump_address_str(res),
+            OP_LT,
+            self._non_jump_operand(a),
+            self._non_jump_operand(b),
+            self._non_jump_operand(res),
         )
 
     def _create_output_code(self, a: Address):
-        return Code("PRINT", self._non_jump_address_str(a))
+        return Code(OP_PRINT, self._non_jump_operand(a))
 
     def _push_stack(self, element, symbol_type: SymbolType):
         self.semantic_stack.append(symbol_type)
@@ -661,22 +961,26 @@ class CodeGenerator:
         return self.stack.pop(), self.semantic_stack.pop()
 
     @staticmethod
-    def _non_jump_address_str(address: Address):
+    def _non_jump_operand(address: Address) -> int:
+        if not address.address:
+            return MODE_NONE
         if address.address_type == AddressType.CONST:
-            return f"#{address.address}"
+            return operand(MODE_CONST, int(address.address))
         if address.address_type == AddressType.INDIRECT:
-            return f"@{address.address}"
+            return operand(MODE_INDIRECT, int(address.address))
         if address.address_type == AddressType.IMMEDIATE:
-            return address.address
-        return ""
+            return operand(MODE_DIRECT, int(address.address))
+        return MODE_NONE
 
     @staticmethod
-    def _jump_address_str(address: Address):
+    def _jump_operand(address: Address) -> int:
+        if not address.address:
+            return MODE_NONE
         if address.address_type == AddressType.CONST:
-            return address.address
+            return operand(MODE_DIRECT, int(address.address))
         if address.address_type == AddressType.IMMEDIATE:
-            return f"@{address.address}"
-        return ""
+            return operand(MODE_INDIRECT, int(address.address))
+        return MODE_NONE
 
     def _handle_semantic_error(self, error_type: SemanticErrorType, details):
         self._has_error = True
@@ -1,39 +1,86 @@
 # Amirsalar Safaei Ghaderi 99100177
 # Seyed Mostafa Hosseini 99170383
-import json
+import argparse
 from parser import Parser
 
 from codegen import CodeGenerator
+from grammar import load_grammar
+from parsergen import load_generated_parser
 from scanner import Scanner
+from tokens import TokenBuffer
 
-with open("grammar-output.json", "r") as f:
-    grammar_def_dict = json.load(f)
 
-f_input = open("input.txt", "r")
-f_tokens = open("tokens.txt", "w")
-f_lexical_errors = open("lexical_errors.txt", "w")
-f_syntax_errors = open("syntax_errors.txt", "w")
-f_symbols = open("symbol_table.txt", "w")
-f_parse_tree = open("parse_tree.txt", "w")
-f_codegen = open("output.txt", "w")
-f_semantic_errors = open("semantic_errors.txt", "w")
+def main():
+    arg_parser = argparse.ArgumentParser(description="Compile input.txt from C-minus.")
+    arg_parser.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help="lex the input in this many processes (default: 1)",
+    )
+    arg_parser.add_argument(
+        "--no-parse-tree", dest="parse_tree", action="store_false",
+        help="do not build the parse tree or write parse_tree.txt",
+    )
+    arg_parser.add_argument(
+        "--parse-tree-format", choices=Parser.PARSE_TREE_FORMATS, default="ascii",
+        help="ascii draws the tree, depth writes one 'depth<TAB>label' line per node (default: ascii)",
+    )
+    arg_parser.add_argument(
+        "--parser", choices=("table", "generated"), default="table",
+        help="parse with the LL(1) table loop or with code generated from the grammar (default: table)",
+    )
+    arg_parser.add_argument(
+        "--max-syntax-errors", type=int, default=None, metavar="N",
+        help="stop parsing after N syntax errors and only scan the rest of the input",
+    )
+    arg_parser.add_argument(
+        "--stream-output", action="store_true",
+        help="hold only the function being compiled instead of the whole program; the peephole "
+             "pass then runs per function and keeps functions that are never called",
+    )
+    args = arg_parser.parse_args()
+    if args.max_syntax_errors is not None and args.max_syntax_errors < 1:
+        arg_parser.error("--max-syntax-errors must be at least 1")
 
+    grammar_def_dict = load_grammar("grammar.txt")
 
-scanner = Scanner(f_input, f_lexical_errors, f_symbols)
-code_gen = CodeGenerator(f_codegen, f_semantic_errors, scanner)
-parser = Parser(scanner, code_gen, grammar_def_dict, f_syntax_errors, f_parse_tree)
+    f_input = open("input.txt", "r")
+    f_tokens = open("tokens.txt", "w")
+    f_lexical_errors = open("lexical_errors.txt", "w")
+    f_syntax_errors = open("syntax_errors.txt", "w")
+    f_symbols = open("symbol_table.txt", "w")
+    f_parse_tree = open("parse_tree.txt", "w") if args.parse_tree else None
+    f_codegen = open("output.txt", "w")
+    f_semantic_errors = open("semantic_errors.txt", "w")
 
-parser.parse()
 
-if scanner.last_error_lineno == 0:
-    f_lexical_errors.write("There is no lexical error.")
+    scanner = Scanner(f_input, f_lexical_errors, f_symbols)
+    tokens = scanner
+    if args.jobs > 1:
+        buffer = TokenBuffer.lex_parallel(scanner.source.text, args.jobs, scanner.fast_path)
+        tokens = buffer.reader(scanner)
+    code_gen = CodeGenerator(f_codegen, f_semantic_errors, tokens, args.stream_output)
+    parser_class = load_generated_parser("grammar.txt") if args.parser == "generated" else Parser
+    parser = parser_class(tokens, code_gen, grammar_def_dict, f_syntax_errors, f_parse_tree,
+                          args.parse_tree, args.parse_tree_format, args.max_syntax_errors)
 
-f_input.close()
-f_tokens.close()
-f_lexical_errors.close()
-f_syntax_errors.close()
-f_symbols.close()
-f_parse_tree.close()
-f_codegen.close()
-f_semantic_errors.close()
+    try:
+        parser.parse()
+    finally:
+        code_gen.close()
 
+    if scanner.last_error_lineno == 0:
+        f_lexical_errors.write("There is no lexical error.")
+
+    f_input.close()
+    f_tokens.close()
+    f_lexical_errors.close()
+    f_syntax_errors.close()
+    f_symbols.close()
+    if f_parse_tree is not None:
+        f_parse_tree.close()
+    f_codegen.close()
+    f_semantic_errors.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,17 @@ VALID_INPUTS = (
     + tuple(string.ascii_letters)
     + tuple(string.digits)
 )
+# terminals of grammar.txt; a token's kind is its index in this tuple
+TERMINALS = END_OF_FILE + ("ID", "NUM") + KEYWORDS + SYMBOLS + ("=", "==", "*")
+TERMINAL_KINDS = {terminal: kind for kind, terminal in enumerate(TERMINALS)}
+# instructions of the target machine; an instruction's opcode is its index in this tuple
+OPS = ("ADD", "MULT", "SUB", "EQ", "LT", "ASSIGN", "JPF", "JP", "PRINT")
+OP_ADD, OP_MULT, OP_SUB, OP_EQ, OP_LT, OP_ASSIGN, OP_JPF, OP_JP, OP_PRINT = range(len(OPS))
+# an instruction operand is packed into an int as value << 2 | mode; a
+# missing operand is 0, ``n`` is a location, ``@n`` a pointer and ``#n`` a constant
+MODE_NONE, MODE_DIRECT, MODE_INDIRECT, MODE_CONST = range(4)
+# a constant folded at compile time must fit a word of the target machine
+WORD_LIMIT = 2 ** 31
 
 
 class TokenType(Enum):
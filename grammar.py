@@ -0,0 +1,190 @@
+import hashlib
+import json
+import marshal
+import os
+import sys
+from typing import Dict, List, Optional, Set
+
+END_MARKER = "$"
+EPSILON = "EPSILON"
+
+
+class Rule:
+    def __init__(self, left: str, right_with_actions: List[Optional[str]]):
+        self.left = left
+        self.right_with_actions = right_with_actions
+        self.right = [i for i in right_with_actions if i is None or not i.startswith("#")]
+
+
+def parse_rules(text: str) -> List[Rule]:
+    """Rules of a grammar file: one non-terminal per line followed by its
+    ``|``-separated alternatives, with ``EPSILON`` for the empty one."""
+    rules = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        left, _, right = line.strip().partition(" ")
+        for alternative in right.split("|"):
+            symbols = alternative.split()
+            if not symbols:
+                continue
+            if len(symbols) == 1 and symbols[0].upper() == EPSILON:
+                symbols = [None]
+            rules.append(Rule(left, symbols))
+    return rules
+
+
+def _sequence_first(symbols: List[Optional[str]], firsts: Dict[str, Set[Optional[str]]]) -> Set[Optional[str]]:
+    result = set()
+    for symbol in symbols:
+        if symbol is None:
+            continue
+        if symbol not in firsts:
+            result.add(symbol)
+            return result
+        result |= firsts[symbol] - {None}
+        if None not in firsts[symbol]:
+            return result
+    result.add(None)
+    return result
+
+
+def first_sets(rules: List[Rule], non_terminals: List[str]) -> Dict[str, Set[Optional[str]]]:
+    """FIRST set of every non-terminal; ``None`` stands for epsilon."""
+    firsts = {non_terminal: set() for non_terminal in non_terminals}
+    changed = True
+    while changed:
+        changed = False
+        for rule in rules:
+            first = _sequence_first(rule.right, firsts)
+            if not first <= firsts[rule.left]:
+                firsts[rule.left] |= first
+                changed = True
+    return firsts
+
+
+def follow_sets(rules: List[Rule], non_terminals: List[str],
+                firsts: Dict[str, Set[Optional[str]]]) -> Dict[str, Set[str]]:
+    """FOLLOW set of every non-terminal, the first rule's left side being the start symbol."""
+    follows = {non_terminal: set() for non_terminal in non_terminals}
+    follows[rules[0].left].add(END_MARKER)
+    changed = True
+    while changed:
+        changed = False
+        for rule in rules:
+            for i, symbol in enumerate(rule.right):
+                if symbol not in follows:
+                    continue
+                rest = _sequence_first(rule.right[i + 1:], firsts)
+                follow = rest - {None}
+                if None in rest:
+                    follow |= follows[rule.left]
+                if not follow <= follows[symbol]:
+                    follows[symbol] |= follow
+                    changed = True
+    return follows
+
+
+def predict_sets(rules: List[Rule], firsts: Dict[str, Set[Optional[str]]],
+                 follows: Dict[str, Set[str]]) -> List[Set[str]]:
+    """Lookahead terminals selecting each rule."""
+    predicts = []
+    for rule in rules:
+        first = _sequence_first(rule.right, firsts)
+        predict = first - {None}
+        if None in first:
+            predict |= follows[rule.left]
+        predicts.append(predict)
+    return predicts
+
+
+def build_grammar(text: str) -> dict:
+    """LL(1) description of a grammar in the layout the Parser reads.
+
+    ``table`` maps a non-terminal and a lookahead terminal to the right side
+    of the rule to expand, action symbols included; when two rules predict
+    the same terminal the later one wins.
+    """
+    rules = parse_rules(text)
+    non_terminals = []
+    for rule in rules:
+        if rule.left not in non_terminals:
+            non_terminals.append(rule.left)
+    firsts = first_sets(rules, non_terminals)
+    follows = follow_sets(rules, non_terminals, firsts)
+    predicts = predict_sets(rules, firsts, follows)
+
+    table: Dict[str, Dict[str, List[Optional[str]]]] = {}
+    for rule, predict in zip(rules, predicts):
+        row = table.setdefault(rule.left, {})
+        for terminal in sorted(predict):
+            row[terminal] = rule.right_with_actions
+    return {
+        "firsts": {k: sorted(v, key=_none_first) for k, v in firsts.items()},
+        "follows": {k: sorted(v) for k, v in follows.items()},
+        "predict": [sorted(predict) for predict in predicts],
+        "table": table,
+        "non_terminals": non_terminals,
+    }
+
+
+def _none_first(symbol):
+    return (symbol is not None, symbol or "")
+
+
+# bump when the cached layout or the table construction changes
+CACHE_FORMAT = 1
+_CACHED_KEYS = ("follows", "table", "non_terminals")
+
+
+def cache_file(grammar_path: str, source: bytes, kind: str, cache_dir: Optional[str] = None) -> str:
+    """Path of the ``kind`` artifact built from a grammar, named after a hash of
+    its text; in ``__pycache__`` next to the grammar unless ``cache_dir`` is given."""
+    digest = hashlib.sha256(source + b"\0%d" % CACHE_FORMAT).hexdigest()[:20]
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(grammar_path)), "__pycache__")
+    return os.path.join(cache_dir, f"grammar.{digest}.{kind}")
+
+
+def read_cache(cache_path: str):
+    """The marshalled value at ``cache_path``, or None if it is missing or unreadable."""
+    try:
+        with open(cache_path, "rb") as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def write_cache(cache_path: str, value):
+    """Marshal ``value`` to ``cache_path``; an unwritable cache is skipped."""
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            marshal.dump(value, f)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+
+
+def load_grammar(path: str = "grammar.txt", cache_dir: Optional[str] = None) -> dict:
+    """The Parser's view of the grammar at ``path``, built once per grammar.
+
+    The table, follow sets and non-terminals are kept in ``cache_dir``
+    (``__pycache__`` next to the grammar by default) in a marshal file named
+    after a hash of the grammar text, so later runs only unmarshal it.
+    """
+    with open(path, "rb") as f:
+        source = f.read()
+    cache_path = cache_file(path, source, "ll1", cache_dir)
+    grammar = read_cache(cache_path)
+    if grammar is None:
+        grammar = build_grammar(source.decode("utf-8"))
+        grammar = {key: grammar[key] for key in _CACHED_KEYS}
+        write_cache(cache_path, grammar)
+    return grammar
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1] if len(sys.argv) > 1 else "grammar.txt") as grammar_file:
+        json.dump(build_grammar(grammar_file.read()), sys.stdout, indent=2)
@@ -1,5 +1,6 @@
 import string
-from typing import Iterable, Sequence, Optional, Callable
+from array import array
+from typing import Dict, Iterable, List, Sequence, Optional, Callable
 from consts import *
 
 
@@ -26,6 +27,66 @@ class DFA:
     def get_state(self, name) -> "State":
         return self.states.get(name, None)
 
+    def compile(self) -> "DFATable":
+        self.table = DFATable(self)
+        return self.table
+
+
+class DFATable:
+    """Dense state x character-class view of a built DFA.
+
+    States are numbered in insertion order and characters are grouped into
+    classes that every edge of the DFA treats alike, so stepping is two list
+    lookups instead of walking ``State.edges``.
+    """
+
+    def __init__(self, dfa: DFA):
+        names = list(dfa.states.keys())
+        states = [dfa.states[name] for name in names]
+        self.state_ids: Dict[str, int] = {name: i for i, name in enumerate(names)}
+        self.start = self.state_ids['start']
+
+        edges = [edge for state in states for edge in state.edges]
+        mentioned = sorted({ch for edge in edges for ch in edge.alpha})
+        # any character no edge mentions behaves like this one
+        other_char = '\0'
+        while other_char in mentioned:
+            other_char = chr(ord(other_char) + 1)
+
+        signatures: Dict[tuple, int] = {}
+        representatives: List[str] = []
+
+        def class_of(ch):
+            signature = tuple(edge.check(ch) for edge in edges)
+            if signature not in signatures:
+                signatures[signature] = len(representatives)
+                representatives.append(ch)
+            return signatures[signature]
+
+        self.other_class = class_of(other_char)
+        self.char_classes: Dict[str, int] = {ch: class_of(ch) for ch in mentioned}
+
+        self.transitions: List[array] = []
+        self.consumes: List[array] = []
+        for state in states:
+            transition = array('b', [-1] * len(representatives))
+            consume = array('b', [0] * len(representatives))
+            for char_class, ch in enumerate(representatives):
+                try:
+                    edge = state.next(ch)
+                except Exception:
+                    continue
+                transition[char_class] = self.state_ids[edge.to_name()]
+                consume[char_class] = edge.consume_char
+            self.transitions.append(transition)
+            self.consumes.append(consume)
+
+        self.accepts: List[Optional[TokenType]] = [state.accept for state in states]
+        self.errors: List[Optional[ScannerErrorType]] = [state.error for state in states]
+        self.on_enters: List[Optional[Callable]] = [
+            None if state.on_enter is do_nothing else state.on_enter for state in states
+        ]
+
 
 class State:
     def __init__(self, edges, on_enter: Callable = do_nothing, accept: Optional[TokenType] = None,
@@ -72,6 +133,14 @@ class Edge:
             return DFA().get_state(self._to)
         return self._to
 
+    def to_name(self):
+        if isinstance(self._to, str):
+            return self._to
+        for name, state in DFA().states.items():
+            if state is self._to:
+                return name
+        raise Exception('edge target is not a state of the dfa')
+
 
 def build_dfa():
     if DFA.get_instance() is not None:
@@ -250,3 +319,5 @@ def build_dfa():
             error=ScannerErrorType.INVALID_INPUT,
         )
     )
+
+    dfa.compile()
@@ -0,0 +1,457 @@
+import heapq
+from typing import Collection, Dict, List, Optional, Set, Tuple
+
+from consts import (
+    MODE_CONST,
+    MODE_DIRECT,
+    MODE_INDIRECT,
+    OP_ADD,
+    OP_ASSIGN,
+    OP_JP,
+    OP_JPF,
+    OP_PRINT,
+    OP_SUB,
+)
+from util import CallSiteDetails, ProgramBlock, operand
+
+
+def split_operand(packed: int) -> Tuple[Optional[int], bool]:
+    """Memory location named by a packed operand and whether it is
+    dereferenced: ``#n`` names none, ``@n`` reads ``n`` as a pointer and ``n``
+    is the location itself."""
+    mode = packed & 3
+    if mode == MODE_DIRECT:
+        return packed >> 2, False
+    if mode == MODE_INDIRECT:
+        return packed >> 2, True
+    return None, False
+
+
+def reads_and_write(pb: ProgramBlock, i: int) -> Tuple[List[int], Optional[int]]:
+    """Locations ``pb[i]`` reads and the one it certainly overwrites.
+
+    A store through a pointer reads the pointer and overwrites nothing known.
+    """
+    i -= pb.base
+    op = pb.ops[i]
+    if op == OP_JP:
+        location, indirect = split_operand(pb.a[i])
+        return ([location] if indirect else []), None
+    if op == OP_JPF or op == OP_PRINT:
+        location, _ = split_operand(pb.a[i])
+        return ([location] if location is not None else []), None
+    if op == OP_ASSIGN:
+        sources, target = (pb.a[i],), pb.b[i]
+    else:
+        sources, target = (pb.a[i], pb.b[i]), pb.c[i]
+    reads = []
+    for packed in sources:
+        location, _ = split_operand(packed)
+        if location is not None:
+            reads.append(location)
+    location, indirect = split_operand(target)
+    if indirect:
+        reads.append(location)
+        return reads, None
+    return reads, location
+
+
+def jump_target(pb: ProgramBlock, i: int) -> Optional[int]:
+    """Code address ``pb[i]``, a JP or JPF, may continue at; None for other
+    instructions, for returns through ``JP @n`` and for jumps not patched yet."""
+    i -= pb.base
+    op = pb.ops[i]
+    if op == OP_JP:
+        packed = pb.a[i]
+    elif op == OP_JPF:
+        packed = pb.b[i]
+    else:
+        return None
+    return packed >> 2 if packed & 3 == MODE_DIRECT else None
+
+
+def _is_return(pb: ProgramBlock, i: int) -> bool:
+    i -= pb.base
+    return pb.ops[i] == OP_JP and pb.a[i] & 3 == MODE_INDIRECT
+
+
+def has_unpatched_jump(pb: ProgramBlock, start: int, end: int) -> bool:
+    """Whether a JP or JPF in ``pb[start:end]`` was never given its target."""
+    ops, a, b = pb.ops, pb.a, pb.b
+    for i in range(start - pb.base, end - pb.base):
+        if ops[i] == OP_JP and not a[i] or ops[i] == OP_JPF and not b[i]:
+            return True
+    return False
+
+
+def successors(pb: ProgramBlock, i: int, calls: Collection[int]) -> List[int]:
+    """Instructions that may run after ``pb[i]``; a call in ``calls`` comes
+    back to the instruction after it."""
+    op = pb.ops[i - pb.base]
+    if op == OP_JP:
+        if i in calls:
+            return [i + 1]
+        target = jump_target(pb, i)
+        return [] if target is None else [target]
+    if op == OP_JPF:
+        return [i + 1, jump_target(pb, i)]
+    return [i + 1]
+
+
+class ControlFlowGraph:
+    """Basic blocks of ``pb[start:end]`` and the edges between them.
+
+    A block starts at ``start``, at a jump target inside the range and after
+    every JP or JPF; a call in ``calls`` ends its block and continues into
+    the next one, where the callee returns. ``starts[b]`` and ``ends[b]``
+    delimit block ``b`` and ``block_of[i - start]`` is the block of
+    ``pb[i]``. Edges leaving the range are left out.
+    """
+
+    def __init__(self, pb: ProgramBlock, start: int, end: int, calls: Collection[int]):
+        self.start = start
+        leaders = {start}
+        for i in range(start, end):
+            op = pb.ops[i - pb.base]
+            if op != OP_JP and op != OP_JPF:
+                continue
+            leaders.add(i + 1)
+            target = None if i in calls else jump_target(pb, i)
+            if target is not None and start <= target < end:
+                leaders.add(target)
+        self.starts = sorted(leader for leader in leaders if leader < end)
+        self.ends = self.starts[1:] + [end]
+        self.block_of = []
+        for b, (first, last) in enumerate(zip(self.starts, self.ends)):
+            self.block_of.extend([b] * (last - first))
+        self.successors: List[List[int]] = []
+        self.predecessors: List[List[int]] = [[] for _ in self.starts]
+        for b, last in enumerate(self.ends):
+            following = []
+            for j in successors(pb, last - 1, calls):
+                if start <= j < end and self.block_of[j - start] not in following:
+                    following.append(self.block_of[j - start])
+            self.successors.append(following)
+            for c in following:
+                self.predecessors[c].append(b)
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class Liveness:
+    """Backward liveness of the ``tracked`` locations over ``pb[start:end]``.
+
+    ``tracked`` maps a location to its bit. The instructions are decoded
+    once; ``remove`` then makes one behave as if it were absent, so live sets
+    can be recomputed cheaply while instructions are being deleted. The
+    fixpoint is reached over the basic blocks of the range's control flow
+    graph and then spread over their instructions. Control leaving the range
+    ends every tracked location's life.
+    """
+
+    def __init__(self, pb: ProgramBlock, start: int, end: int, calls: Collection[int], tracked: Dict[int, int]):
+        self.start = start
+        self.cfg = ControlFlowGraph(pb, start, end, calls)
+        count = end - start
+        self.uses = [0] * count
+        self.kills = [0] * count
+        for i in range(start, end):
+            reads, write = reads_and_write(pb, i)
+            for location in reads:
+                if location in tracked:
+                    self.uses[i - start] |= 1 << tracked[location]
+            if write in tracked:
+                self.kills[i - start] = 1 << tracked[write]
+
+    def remove(self, i: int):
+        """Treat ``pb[i]``, which falls through, as deleted."""
+        self.uses[i - self.start] = self.kills[i - self.start] = 0
+
+    def live_in(self) -> List[int]:
+        """Entry ``i - start`` is the set of tracked locations live on entry to ``pb[i]``."""
+        cfg, uses, kills, start = self.cfg, self.uses, self.kills, self.start
+        # what each block reads before writing it, and everything it writes
+        gens, block_kills = [], []
+        for first, last in zip(cfg.starts, cfg.ends):
+            gen = kill = 0
+            for i in range(last - start - 1, first - start - 1, -1):
+                gen = uses[i] | (gen & ~kills[i])
+                kill |= kills[i]
+            gens.append(gen)
+            block_kills.append(kill)
+        block_live = list(gens)
+        pending = list(range(len(cfg)))
+        queued = [True] * len(cfg)
+        while pending:
+            b = pending.pop()
+            queued[b] = False
+            out = 0
+            for c in cfg.successors[b]:
+                out |= block_live[c]
+            value = gens[b] | (out & ~block_kills[b])
+            if value != block_live[b]:
+                block_live[b] = value
+                for p in cfg.predecessors[b]:
+                    if not queued[p]:
+                        queued[p] = True
+                        pending.append(p)
+        live = [0] * len(uses)
+        for b, (first, last) in enumerate(zip(cfg.starts, cfg.ends)):
+            value = 0
+            for c in cfg.successors[b]:
+                value |= block_live[c]
+            for i in range(last - start - 1, first - start - 1, -1):
+                value = uses[i] | (value & ~kills[i])
+                live[i] = value
+        return live
+
+    def live_out(self, live: List[int], i: int) -> int:
+        """Tracked locations live right after ``pb[i]``, given ``live = live_in()``."""
+        cfg, start = self.cfg, self.start
+        b = cfg.block_of[i - start]
+        if i + 1 < cfg.ends[b]:
+            return live[i + 1 - start]
+        value = 0
+        for c in cfg.successors[b]:
+            value |= live[cfg.starts[c] - start]
+        return value
+
+
+def live_intervals(liveness: Liveness, live: List[int]) -> Dict[int, Tuple[int, int]]:
+    """First and last instruction, relative to the range of ``liveness``,
+    at which each tracked bit is live or written; ``live`` is the result of
+    ``liveness.live_in()``. Bits never referenced are left out."""
+    intervals: Dict[int, Tuple[int, int]] = {}
+    for i, (live_here, written) in enumerate(zip(live, liveness.kills)):
+        bits = live_here | written
+        while bits:
+            low = bits & -bits
+            bit = low.bit_length() - 1
+            bits ^= low
+            first, _ = intervals.get(bit, (i, i))
+            intervals[bit] = (first, i)
+    return intervals
+
+
+def linear_scan(intervals: Dict[int, Tuple[int, int]], slots: List[int]) -> Dict[int, int]:
+    """Slot of each key of ``intervals`` such that keys whose intervals
+    overlap get different slots, taking free ``slots`` lowest first.
+
+    ``slots`` must hold at least as many slots as there are intervals.
+    """
+    free = sorted(slots)
+    heapq.heapify(free)
+    active: List[Tuple[int, int]] = []
+    assignment = {}
+    for key, (first, last) in sorted(intervals.items(), key=lambda item: item[1]):
+        while active and active[0][0] < first:
+            heapq.heappush(free, heapq.heappop(active)[1])
+        slot = heapq.heappop(free)
+        assignment[key] = slot
+        heapq.heappush(active, (last, slot))
+    return assignment
+
+
+def _data_columns(pb: ProgramBlock, i: int) -> tuple:
+    """Operand columns of ``pb[i]`` that name data rather than code."""
+    op = pb.ops[i - pb.base]
+    if op == OP_JP:
+        return (pb.a,) if _is_return(pb, i) else ()
+    if op == OP_JPF or op == OP_PRINT:
+        return (pb.a,)
+    if op == OP_ASSIGN:
+        return pb.a, pb.b
+    return pb.a, pb.b, pb.c
+
+
+def rename_locations(pb: ProgramBlock, start: int, end: int, renamed: Dict[int, int]):
+    """Replace each location in ``renamed`` by its new one wherever
+    ``pb[start:end]`` reads or writes it, directly or as a pointer."""
+    for i in range(start, end):
+        j = i - pb.base
+        for column in _data_columns(pb, i):
+            packed = column[j]
+            location, indirect = split_operand(packed)
+            if location in renamed:
+                column[j] = operand(packed & 3, renamed[location])
+
+
+def remove_codes(pb: ProgramBlock, start: int, removed: Set[int], sites: List[CallSiteDetails] = (),
+                 entries: List[int] = None):
+    """Delete ``pb[i]`` for each ``i`` in ``removed`` (all at or after ``start``).
+
+    Jump targets in ``pb[start:]``, the return addresses the call ``sites``
+    assign, the sites' own indices and the code addresses in ``entries`` are
+    renumbered; a target that was
+    deleted moves to the next kept instruction. Code before ``start`` must
+    not jump past it.
+    """
+    if not removed:
+        return
+    new_index = []
+    kept = start
+    for i in range(start, len(pb) + 1):
+        new_index.append(kept)
+        if i not in removed:
+            kept += 1
+
+    def moved(address: int) -> int:
+        return new_index[address - start] if address >= start else address
+
+    for site in sites:
+        j = site.return_pb_idx - pb.base
+        pb.a[j] = operand(MODE_CONST, moved(pb.a[j] >> 2))
+        site.return_pb_idx = moved(site.return_pb_idx)
+        site.jp_pb_idx = moved(site.jp_pb_idx)
+        site.resume_pb_idx = moved(site.resume_pb_idx)
+        site.spills = [
+            (location, moved(save), moved(restore))
+            for location, save, restore in site.spills
+            if save not in removed
+        ]
+    for i in range(start, len(pb)):
+        target = jump_target(pb, i)
+        if target is None:
+            continue
+        pb.patch_jump(i, operand(MODE_DIRECT, moved(target)))
+    if entries is not None:
+        entries[:] = [moved(entry) for entry in entries]
+    pb.delete(start, removed)
+
+
+def _threaded(pb: ProgramBlock, target: int, calls: Collection[int], end: int) -> int:
+    """Where a jump to ``target`` ends up after following plain JPs before ``end``."""
+    seen = set()
+    while target not in seen and target < end:
+        if pb.ops[target - pb.base] != OP_JP or target in calls or _is_return(pb, target):
+            break
+        seen.add(target)
+        target = jump_target(pb, target)
+    return target
+
+
+def _adjustment(pb: ProgramBlock, i: int) -> Optional[Tuple[int, int]]:
+    """Location operand and amount of an ``ADD x, #n, x`` or ``SUB x, #n, x``."""
+    i -= pb.base
+    op, a, b = pb.ops[i], pb.a[i], pb.b[i]
+    if op != OP_ADD and op != OP_SUB or a != pb.c[i] or b & 3 != MODE_CONST or a & 3 != MODE_DIRECT:
+        return None
+    amount = b >> 2
+    return a, amount if op == OP_ADD else -amount
+
+
+def reachable(pb: ProgramBlock, calls: Collection[int], start: int = 0, end: Optional[int] = None,
+              entries: Collection[int] = (0,)) -> List[bool]:
+    """Item ``i - start`` tells whether ``pb[i]`` can be reached from one of
+    the ``entries`` without leaving ``pb[start:end]``, a call reaching both
+    the callee and, once it returns, the instruction after it."""
+    if end is None:
+        end = len(pb)
+    seen = [False] * (end - start)
+    pending = list(entries)
+    while pending:
+        i = pending.pop()
+        if not start <= i < end or seen[i - start]:
+            continue
+        seen[i - start] = True
+        pending.extend(successors(pb, i, calls))
+        if i in calls:
+            pending.append(jump_target(pb, i))
+    return seen
+
+
+def peephole(pb: ProgramBlock, sites: List[CallSiteDetails], start: int = 0, end: Optional[int] = None,
+             entries: Optional[List[int]] = None):
+    """Local clean-up of ``pb[start:end]``, by default the finished program
+    block, repeated until it is stable.
+
+    Jumps to a JP are sent to its target, and to a return are replaced by
+    the return; a JPF on a constant zero becomes a JP; any other constant
+    condition, jumps to the next instruction, ``ASSIGN x, x`` and code that
+    can not be reached from the ``entries`` are deleted; neighbouring
+    ``ADD x, #n, x`` / ``SUB x, #n, x`` adjustments of a location, such as
+    the stack pointer, are merged. Call ``sites`` whose code is deleted are
+    dropped from the list and the others renumbered, as are the ``entries``,
+    by default just ``start``. A range holding a jump that was never patched
+    is left as it is.
+
+    Run over the code generated since a function's predecessor, with the
+    function's first instruction as entry, this is the whole-program pass
+    less the removal of functions that are never called.
+    """
+    if end is None:
+        end = len(pb)
+    if entries is None:
+        entries = [start]
+    if has_unpatched_jump(pb, start, end):
+        return
+    ops, a, b, base = pb.ops, pb.a, pb.b, pb.base
+    while True:
+        calls = {site.jp_pb_idx for site in sites}
+        for i in range(start, end):
+            if i in calls:
+                continue
+            j = i - base
+            if ops[j] == OP_JPF and a[j] == operand(MODE_CONST, 0):
+                ops[j], a[j], b[j] = OP_JP, b[j], 0
+            target = jump_target(pb, i)
+            if target is None:
+                continue
+            final = _threaded(pb, target, calls, end)
+            if ops[j] == OP_JPF:
+                b[j] = operand(MODE_DIRECT, final)
+            elif final < end and _is_return(pb, final):
+                a[j] = a[final - base]
+            else:
+                a[j] = operand(MODE_DIRECT, final)
+
+        # return points are reached from the callee's JP @ra
+        targets = {a[site.return_pb_idx - base] >> 2 for site in sites}
+        targets.update(entries)
+        for i in range(start, end):
+            target = jump_target(pb, i)
+            if target is not None:
+                targets.add(target)
+        live = reachable(pb, calls, start, end, entries)
+        removed = {start + k for k, is_live in enumerate(live) if not is_live}
+        i = start
+        while i < end:
+            j = i - base
+            op = ops[j]
+            if i in removed or i in calls:
+                i += 1
+                continue
+            if op == OP_ASSIGN and a[j] == b[j] and a[j] & 3 != MODE_CONST:
+                removed.add(i)
+            elif op == OP_JPF and a[j] & 3 == MODE_CONST:
+                # a constant condition other than zero never jumps
+                removed.add(i)
+            elif (op == OP_JP or op == OP_JPF) and jump_target(pb, i) == i + 1:
+                removed.add(i)
+            else:
+                adjustment = _adjustment(pb, i)
+                following = i + 1
+                if adjustment is not None:
+                    while following < end and following not in targets and following not in removed:
+                        other = _adjustment(pb, following)
+                        if other is None or other[0] != adjustment[0]:
+                            break
+                        adjustment = (adjustment[0], adjustment[1] + other[1])
+                        removed.add(following)
+                        following += 1
+                    if following > i + 1:
+                        amount = adjustment[1]
+                        if amount == 0:
+                            removed.add(i)
+                        else:
+                            ops[j] = OP_ADD if amount > 0 else OP_SUB
+                            b[j] = operand(MODE_CONST, abs(amount))
+                i = following
+                continue
+            i += 1
+        if not removed:
+            return
+        sites[:] = [site for site in sites if site.jp_pb_idx not in removed]
+        remove_codes(pb, start, removed, sites, entries)
+        end -= len(removed)
@@ -0,0 +1,147 @@
+from array import array
+from typing import Iterator, List, Sequence
+
+
+class ParseTree:
+    """Parse tree stored as parallel arrays indexed by node id.
+
+    Every node has a label, a parent, a first child and next and previous
+    siblings, with -1 for none, so adding a node costs a few array appends
+    instead of an object with its own child list and ancestor checks, and a
+    node is unlinked from its siblings in constant time.
+    """
+
+    # pieces of output collected before each write
+    WRITE_CHUNK = 4096
+
+    def __init__(self):
+        self.labels: List[str] = []
+        self.parents = array('i')
+        self.first_children = array('i')
+        self.next_siblings = array('i')
+        self.prev_siblings = array('i')
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add_node(self, label: str) -> int:
+        """A new detached node."""
+        node = len(self.labels)
+        self.labels.append(label)
+        self.parents.append(-1)
+        self.first_children.append(-1)
+        self.next_siblings.append(-1)
+        self.prev_siblings.append(-1)
+        return node
+
+    def add_children(self, parent: int, labels: Sequence[str]) -> int:
+        """Append nodes for ``labels`` after the children of ``parent``.
+
+        The new nodes get consecutive ids; the first one is returned.
+        """
+        first = len(self.labels)
+        count = len(labels)
+        self.labels.extend(labels)
+        self.parents.extend([parent] * count)
+        self.first_children.extend([-1] * count)
+        self.next_siblings.extend(range(first + 1, first + count))
+        self.next_siblings.append(-1)
+        self.prev_siblings.append(-1)
+        self.prev_siblings.extend(range(first, first + count - 1))
+        self._link(parent, first)
+        return first
+
+    def append_child(self, parent: int, node: int):
+        """Make the detached ``node`` the last child of ``parent``."""
+        self.parents[node] = parent
+        self.next_siblings[node] = -1
+        self.prev_siblings[node] = -1
+        self._link(parent, node)
+
+    def _link(self, parent: int, node: int):
+        child = self.first_children[parent]
+        if child < 0:
+            self.first_children[parent] = node
+            return
+        next_siblings = self.next_siblings
+        while next_siblings[child] >= 0:
+            child = next_siblings[child]
+        next_siblings[child] = node
+        self.prev_siblings[node] = child
+
+    def detach(self, node: int):
+        """Remove ``node`` and its subtree from its parent's children."""
+        parent = self.parents[node]
+        if parent < 0:
+            return
+        following, preceding = self.next_siblings[node], self.prev_siblings[node]
+        if preceding < 0:
+            self.first_children[parent] = following
+        else:
+            self.next_siblings[preceding] = following
+        if following >= 0:
+            self.prev_siblings[following] = preceding
+        self.parents[node] = -1
+        self.next_siblings[node] = self.prev_siblings[node] = -1
+
+    def children(self, node: int) -> Iterator[int]:
+        child = self.first_children[node]
+        while child >= 0:
+            yield child
+            child = self.next_siblings[child]
+
+    def render(self, root: int, stream):
+        """Write the tree under ``root`` in anytree's RenderTree layout.
+
+        Nodes are visited by following sibling links. The fill in front of a
+        node is the list of segments of its open ancestors, which every line
+        shares, so no prefix string is built. Output is collected in chunks
+        before it is written.
+        """
+        labels, first_children, next_siblings = self.labels, self.first_children, self.next_siblings
+        out = [labels[root]]
+        # per open node: its next child to write; below the root, also the
+        # segment its children's lines carry for it
+        pending = [first_children[root]]
+        segments = []
+        while pending:
+            child = pending[-1]
+            if child < 0:
+                pending.pop()
+                if segments:
+                    segments.pop()
+                continue
+            following = next_siblings[child]
+            pending[-1] = following
+            out.append("\n")
+            out.extend(segments)
+            out.append("├── " if following >= 0 else "└── ")
+            out.append(labels[child])
+            grandchild = first_children[child]
+            if grandchild >= 0:
+                pending.append(grandchild)
+                segments.append("│   " if following >= 0 else "    ")
+            if len(out) > self.WRITE_CHUNK:
+                stream.write("".join(out))
+                out.clear()
+        stream.write("".join(out))
+
+    def render_depths(self, root: int, stream):
+        """Write the tree under ``root`` one node per line as ``depth<TAB>label``,
+        in pre-order with the root at depth 0."""
+        labels, first_children, next_siblings = self.labels, self.first_children, self.next_siblings
+        out = [f"0\t{labels[root]}"]
+        pending = [first_children[root]]
+        while pending:
+            child = pending[-1]
+            if child < 0:
+                pending.pop()
+                continue
+            pending[-1] = next_siblings[child]
+            out.append(f"\n{len(pending)}\t{labels[child]}")
+            if first_children[child] >= 0:
+                pending.append(first_children[child])
+            if len(out) > self.WRITE_CHUNK:
+                stream.write("".join(out))
+                out.clear()
+        stream.write("".join(out))
@@ -1,13 +1,13 @@
-from typing import List
-
-from anytree import Node, RenderTree
+from typing import List, Optional, Tuple
 
 from codegen import CodeGenerator
-from consts import ParserErrorType, TokenType
+from consts import TERMINALS, ParserErrorType, TokenType
+from parse_tree import ParseTree
 from scanner import EndOfFileException, Scanner
 
 
 class Parser:
+    PARSE_TREE_FORMATS = ("ascii", "depth")
 
     def __init__(
         self,
@@ -16,120 +16,249 @@ class Parser:
         grammar: dict,
         errors_stream,
         parse_tree_stream,
+        build_tree: bool = True,
+        parse_tree_format: str = "ascii",
+        max_syntax_errors: Optional[int] = None,
     ) -> None:
+        """With ``build_tree`` off no parse tree is built or written, and
+        ``parse_tree_stream`` may be None. ``parse_tree_format`` is ``ascii``
+        for ParseTree.render or ``depth`` for ParseTree.render_depths.
+        After ``max_syntax_errors`` reported errors parsing stops and the rest
+        of the input is only scanned; the cap is at least 1."""
+        if parse_tree_format not in self.PARSE_TREE_FORMATS:
+            raise ValueError(f"unknown parse tree format {parse_tree_format!r}")
+        if max_syntax_errors is not None and max_syntax_errors < 1:
+            raise ValueError(f"max_syntax_errors must be at least 1, not {max_syntax_errors}")
         self.scanner = scanner
-        self.syncs = grammar.get("follows")
-        self.table = grammar.get("table")
-        self.non_terminals = set(grammar.get("non_terminals"))
-        self.root = Node("Program")
-        self.end_node = Node("$")
-        self.stack: List[Node] = [self.end_node, self.root]
+        self.code_gen = code_gen
+        self._load_grammar(grammar)
+        self.build_tree = build_tree
+        self.parse_tree_format = parse_tree_format
+        self.stack: List[int] = [self.symbol_ids["$"], self.symbol_ids["Program"]]
+        self.tree: Optional[ParseTree] = None
+        self.nodes: Optional[List[int]] = None
+        if build_tree:
+            self.tree = ParseTree()
+            self.root = self.tree.add_node("Program")
+            self.end_node = self.tree.add_node("$")
+            self.nodes = [self.end_node, self.root]
         self.token = None
+        self.token_kind = None
         self.token_id = None
         self.token_type = None
         self._eof_missing = False
+        self._gave_up = False
+        self.max_syntax_errors = max_syntax_errors
+        self.syntax_errors_count = 0
         self.errors_stream = errors_stream
         self.last_error_lineno = 0
         self.parse_tree_stream = parse_tree_stream
-        self.code_gen = code_gen
+
+    def _load_grammar(self, grammar: dict):
+        """Number the grammar symbols and flatten the LL(1) table.
+
+        Terminals take ids ``0 .. first_non_terminal - 1`` in the order of
+        consts.TERMINALS, so a token's kind is its terminal id; non-terminals
+        follow, then action symbols from ``first_action`` on. The symbol class
+        of a stack entry is therefore read off its id.
+        """
+        non_terminals = list(grammar.get("non_terminals"))
+        table = grammar.get("table")
+        actions = []
+        for row in table.values():
+            for rule in row.values():
+                for symbol in rule:
+                    if symbol is not None and symbol.startswith("#") and symbol not in actions:
+                        actions.append(symbol)
+        self.symbol_names: List[str] = list(TERMINALS) + non_terminals + actions
+        self.symbol_ids = {name: i for i, name in enumerate(self.symbol_names)}
+        self.first_non_terminal = len(TERMINALS)
+        self.first_action = len(TERMINALS) + len(non_terminals)
+        terminals_count = len(TERMINALS)
+
+        # rule ids in table, -1 for errors; each rule is its symbol ids in order
+        # (None for epsilon) and the ids to push, last symbol first; rule_labels
+        # hold the parse tree labels of each rule's children
+        self.table = [-1] * (len(non_terminals) * terminals_count)
+        self.rules: List[Tuple[tuple, tuple]] = []
+        self.rule_labels: List[Tuple[str, ...]] = []
+        rule_ids = {}
+        for non_terminal, row in table.items():
+            row_start = (self.symbol_ids[non_terminal] - terminals_count) * terminals_count
+            for terminal, rule in row.items():
+                key = tuple(rule)
+                if key not in rule_ids:
+                    rule_ids[key] = len(self.rules)
+                    symbols = tuple(None if i is None else self.symbol_ids[i] for i in rule)
+                    self.rules.append((symbols, tuple(reversed([i for i in symbols if i is not None]))))
+                    self.rule_labels.append(tuple(
+                        "epsilon" if i is None else self._sanitize_non_terminal_name(i) for i in rule
+                    ))
+                self.table[row_start + self.symbol_ids[terminal]] = rule_ids[key]
+
+        self.syncs = bytearray(len(non_terminals) * terminals_count)
+        for non_terminal, follows in grammar.get("follows").items():
+            row_start = (self.symbol_ids[non_terminal] - terminals_count) * terminals_count
+            for terminal in follows:
+                self.syncs[row_start + self.symbol_ids[terminal]] = 1
+
+        # per non-terminal, the token kinds panic mode discards: neither
+        # predicted by a rule nor in the follow set
+        self.skip_sets: List[frozenset] = [
+            frozenset(
+                kind for kind in range(terminals_count)
+                if self.table[row_start + kind] < 0 and not self.syncs[row_start + kind]
+            )
+            for row_start in range(0, len(self.table), terminals_count)
+        ]
+
+        self.actions = [self.code_gen.resolve_action(name[1:]) for name in actions]
 
     def parse(self):
+        stack, nodes = self.stack, self.nodes
+        table, rules, syncs, actions = self.table, self.rules, self.syncs, self.actions
+        first_non_terminal, first_action = self.first_non_terminal, self.first_action
+        rule_labels, tree = self.rule_labels, self.tree
+        code_gen = self.code_gen
+        build_tree = self.build_tree
         self._read_from_scanner()
-        while len(self.stack) > 0:
-            stack_top = self.stack[-1].name
-            if stack_top.startswith("#"):
-                self.code_gen(stack_top[1:], self._token_pack)
-                self.stack.pop()
-            else:
-                if stack_top not in self.non_terminals:
-                    if stack_top != self.token:
-                        self.error_handler(error_type=ParserErrorType.TOKEN_MISMATCH)
-                    else:
-                        self.stack[-1].name = self._sanitize_terminal_name(
+        while len(stack) > 0:
+            symbol = stack[-1]
+            if symbol >= first_action:
+                code_gen(actions[symbol - first_action], self._token_pack)
+                stack.pop()
+                if build_tree:
+                    nodes.pop()
+            elif symbol < first_non_terminal:
+                if symbol != self.token_kind:
+                    self.error_handler(error_type=ParserErrorType.TOKEN_MISMATCH)
+                else:
+                    if build_tree:
+                        tree.labels[nodes.pop()] = self._sanitize_terminal_name(
                             self.token_type, self.token_id
                         )
-                        self.stack.pop()
-                        self._read_from_scanner()
+                    stack.pop()
+                    self._read_from_scanner()
+            else:
+                cell = (symbol - first_non_terminal) * first_non_terminal + self.token_kind
+                rule = table[cell]
+                if rule >= 0:
+                    push = rules[rule][1]
+                    stack.pop()
+                    stack.extend(push)
+                    if build_tree:
+                        first = tree.add_children(nodes.pop(), rule_labels[rule])
+                        if push:
+                            nodes.extend(range(first + len(push) - 1, first - 1, -1))
                 else:
-                    rule = self.table.get(stack_top, {}).get(self.token, None)
-                    if rule is not None:
-                        extend_list = []
-                        for i in rule:
-                            if i is not None:
-                                extend_list.append(Node(i, self.stack[-1]))
-                            else:
-                                Node("epsilon", self.stack[-1])
-                        self.stack.pop()
-                        self.stack.extend(list(reversed(extend_list)))
+                    if syncs[cell]:
+                        self.error_handler(ParserErrorType.MISSING_NON_TERMINAL)
                     else:
-                        if self.token in self.syncs[stack_top]:
-                            self.error_handler(ParserErrorType.MISSING_NON_TERMINAL)
-                        else:
-                            self.error_handler(ParserErrorType.ILLEGAL_TOKEN)
+                        self.error_handler(ParserErrorType.ILLEGAL_TOKEN)
         self._after_parse()
 
     def error_handler(self, error_type: ParserErrorType):
         if error_type == ParserErrorType.ILLEGAL_TOKEN:
-            if self.token != "$":
-                self._write_to_errors(f"illegal {self.token}", self.scanner.lineno)
-            self._read_from_scanner()
+            # discard the whole run of tokens the non-terminal can neither
+            # start with nor be followed by
+            skip = self.skip_sets[self.stack[-1] - self.first_non_terminal]
+            while True:
+                if self.token != "$":
+                    self._write_to_errors(f"illegal {self.token}", self.scanner.lineno)
+                    if self._error_cap_reached():
+                        break
+                self._read_from_scanner()
+                if self.token_kind not in skip:
+                    break
         elif error_type == ParserErrorType.TOKEN_MISMATCH:
-            if self.stack[-1].name != "$":
-                self._write_to_errors(
-                    f"missing {self.stack[-1].name}", self.scanner.lineno
-                )
-            t = self.stack.pop()
-            if t.parent is not None:
-                t.parent.children = [i for i in t.parent.children if i != t]
+            name = self.symbol_names[self.stack[-1]]
+            self.stack.pop()
+            self._drop_node()
+            if name == "$":
+                # input left after the program is not reported, so it can
+                # not reach the error cap either
+                return
+            self._write_to_errors(
+                f"missing {name}", self.scanner.lineno
+            )
         elif error_type == ParserErrorType.MISSING_NON_TERMINAL:
             self._write_to_errors(
-                f"missing {self._sanitize_non_terminal_name(self.stack[-1].name)}",
+                f"missing {self._sanitize_non_terminal_name(self.symbol_names[self.stack[-1]])}",
                 self.scanner.lineno,
             )
-            nt = self.stack.pop()
-            if nt.parent is not None:
-                nt.parent.children = [i for i in nt.parent.children if i != nt]
+            self.stack.pop()
+            self._drop_node()
         elif error_type == ParserErrorType.UNEXPECTED_EOF:
             self._write_to_errors(f"Unexpected EOF", self.scanner.lineno)
             self._eof_missing = True
-            for nt in self.stack:
-                if nt.parent is not None:
-                    nt.parent.children = [i for i in nt.parent.children if i != nt]
-            self.token_id = self.token_type = self.token = None
-            self.stack = []
+            self._stop()
+        if self._error_cap_reached():
+            self._give_up()
+
+    def _error_cap_reached(self) -> bool:
+        return self.max_syntax_errors is not None and self.syntax_errors_count >= self.max_syntax_errors
+
+    def _stop(self):
+        """Empty the parse stack, dropping the nodes of its symbols."""
+        if self.build_tree:
+            for nt in self.nodes:
+                self.tree.detach(nt)
+            self.nodes.clear()
+        self.token_id = self.token_type = self.token = self.token_kind = None
+        self.stack.clear()
+
+    def _give_up(self):
+        """Stop parsing once max_syntax_errors have been reported; the rest
+        of the input is still scanned for lexical errors and symbols."""
+        self._gave_up = True
+        if not self.stack:
+            return
+        self._stop()
+        try:
+            while True:
+                self.scanner.get_next_token()
+        except EndOfFileException:
+            pass
+
+    def _drop_node(self):
+        """Remove the node of the popped stack entry from the tree."""
+        if self.build_tree:
+            self.tree.detach(self.nodes.pop())
 
     def _read_from_scanner(self):
         if len(self.stack) == 0:
             return
         try:
-            self.token_type, self.token_id = self.scanner.get_next_token()
+            token = self.scanner.get_next_token()
         except EndOfFileException:
+            token = None
             self.error_handler(error_type=ParserErrorType.UNEXPECTED_EOF)
-        self.token = self._sanitize_token_def(
-            token_type=self.token_type, token_id=self.token_id
-        )
-        self._token_pack = (self.token_type, self.token_id)
+        else:
+            self.token_type, self.token_id = token.token_type.name, token.lexeme
+            self.token_kind = token.kind
+            self.token = TERMINALS[token.kind]
+        self._token_pack = token
 
     def _after_parse(self):
-        if not self._eof_missing:
-            self.root.children = list(self.root.children) + [self.end_node]
-        first = True
-        for pre, fill, node in RenderTree(self.root):
-            if first:
-                first = False
-            else:
-                self.parse_tree_stream.write("\n")
-            self.parse_tree_stream.write(
-                "%s%s" % (pre, self._sanitize_non_terminal_name(node.name))
-            )
+        if self.build_tree:
+            self._write_parse_tree()
         if self.last_error_lineno == 0:
             self.errors_stream.write("There is no syntax error.")
 
+    def _write_parse_tree(self):
+        if not self._eof_missing and not self._gave_up:
+            self.tree.append_child(self.root, self.end_node)
+        if self.parse_tree_format == "depth":
+            self.tree.render_depths(self.root, self.parse_tree_stream)
+        else:
+            self.tree.render(self.root, self.parse_tree_stream)
+
     def _write_to_errors(self, error_message, error_line):
         if self.last_error_lineno != 0:
             self.errors_stream.write("\n")
         self.errors_stream.write(f"#{error_line} : syntax error, {error_message}")
         self.last_error_lineno = error_line
+        self.syntax_errors_count += 1
 
     @staticmethod
     def _sanitize_non_terminal_name(name: str) -> str:
@@ -140,9 +269,3 @@ class Parser:
         if token_type == TokenType.END_OF_FILE.name:
             return "$"
         return f"({token_type}, {token_id})"
-
-    @staticmethod
-    def _sanitize_token_def(token_type, token_id) -> str:
-        if token_type == TokenType.ID.name or token_type == TokenType.NUM.name:
-            return token_type
-        return token_id
@@ -0,0 +1,303 @@
+import abc
+import argparse
+import io
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from codegen import CodeGenerator
+from consts import TERMINALS, TERMINAL_KINDS
+from grammar import cache_file, load_grammar, read_cache, write_cache
+from parser import Parser
+from scanner import EndOfFileException
+
+# bump when the generated code changes
+GENERATOR_VERSION = 1
+# right recursion becomes a loop, but nested blocks and expressions still
+# recurse once per level
+RECURSION_LIMIT = 10000
+
+
+class StopParsing(Exception):
+    """Unwinds the generated parsing functions at an unexpected EOF or when
+    the syntax error cap is reached."""
+
+
+class GeneratedParserBase(Parser, metaclass=abc.ABCMeta):
+    """Runtime of the parsers written by generate_parser_source.
+
+    Each non-terminal gets a method ``_parse_<name>(node)`` that picks its rule
+    by the lookahead kind and calls the rule's symbols in turn, so the parse
+    stack is Python's call stack. Errors are reported and recovered from as
+    in Parser.error_handler. A node still waiting on the table-driven
+    parser's stack when parsing stops is dropped here: on the way out each
+    active method detaches the children it has not reached yet.
+    """
+
+    def parse(self):
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+        try:
+            self._next_token()
+            self._parse_start(self.root if self.build_tree else -1)
+        except StopParsing:
+            pass
+        finally:
+            sys.setrecursionlimit(limit)
+        self._after_parse()
+
+    @abc.abstractmethod
+    def _parse_start(self, node: int):
+        """Parse the start symbol into ``node``; set by the generated class."""
+
+    def _next_token(self):
+        try:
+            token = self.scanner.get_next_token()
+        except EndOfFileException:
+            self._write_to_errors(f"Unexpected EOF", self.scanner.lineno)
+            self._eof_missing = True
+            self.token_id = self.token_type = self.token = self.token_kind = None
+            self._token_pack = None
+            raise StopParsing()
+        self.token_type, self.token_id = token.token_type.name, token.lexeme
+        self.token_kind = token.kind
+        self.token = TERMINALS[token.kind]
+        self._token_pack = token
+
+    def _check_error_cap(self):
+        if self._error_cap_reached():
+            self._gave_up = True
+            try:
+                while True:
+                    self.scanner.get_next_token()
+            except EndOfFileException:
+                pass
+            raise StopParsing()
+
+    def _illegal(self, node: int, skip: frozenset):
+        try:
+            while True:
+                if self.token != "$":
+                    self._write_to_errors(f"illegal {self.token}", self.scanner.lineno)
+                    if self._error_cap_reached():
+                        break
+                self._next_token()
+                if self.token_kind not in skip:
+                    break
+            self._check_error_cap()
+        except StopParsing:
+            self._drop_pending(node, node + 1)
+            raise
+
+    def _missing(self, node: int, name: str):
+        self._write_to_errors(f"missing {name}", self.scanner.lineno)
+        self._drop_pending(node, node + 1)
+        self._check_error_cap()
+
+    def _drop_pending(self, first: int, end: int):
+        if self.tree is not None:
+            for node in range(first, end):
+                self.tree.detach(node)
+
+
+def _kinds_literal(kinds) -> str:
+    return "{%s}" % ", ".join(str(kind) for kind in sorted(kinds))
+
+
+def _kinds_test(kinds) -> str:
+    if len(kinds) == 1:
+        return f"k == {next(iter(kinds))}"
+    return f"k in {_kinds_literal(kinds)}"
+
+
+def _method_name(non_terminal: str) -> str:
+    return f"_parse_{non_terminal}"
+
+
+def generate_parser_source(grammar: dict) -> str:
+    """Python source of a GeneratedParser class for a grammar as returned by
+    grammar.load_grammar.
+
+    Rules are chosen with membership tests against constant sets of token
+    kinds, action symbols become direct CodeGenerator method calls and a
+    rule ending in its own non-terminal loops instead of recursing.
+    """
+    table: Dict[str, Dict[str, list]] = grammar["table"]
+    non_terminals: List[str] = list(grammar["non_terminals"])
+    follows: Dict[str, List[str]] = grammar["follows"]
+    lines = [
+        "# Generated by parsergen.py; do not edit.",
+        "from parsergen import GeneratedParserBase, StopParsing",
+        "",
+    ]
+    # token kinds each non-terminal discards in panic mode
+    for non_terminal in non_terminals:
+        stops = {TERMINAL_KINDS[i] for i in table.get(non_terminal, {})}
+        stops |= {TERMINAL_KINDS[i] for i in follows.get(non_terminal, ())}
+        skip = set(range(len(TERMINALS))) - stops
+        lines.append(f"_SKIP_{non_terminal} = frozenset({_kinds_literal(skip)})")
+    lines += ["", "", "class GeneratedParser(GeneratedParserBase):"]
+    emit = lines.append
+
+    for non_terminal in non_terminals:
+        # rules in order of first appearance in the table row, with their kinds
+        rules: List[Tuple[list, set]] = []
+        rule_index: Dict[tuple, int] = {}
+        for terminal, rule in table.get(non_terminal, {}).items():
+            key = tuple(rule)
+            if key not in rule_index:
+                rule_index[key] = len(rules)
+                rules.append((rule, set()))
+            rules[rule_index[key]][1].add(TERMINAL_KINDS[terminal])
+        predicted = set().union(*(kinds for _, kinds in rules))
+        syncs = {TERMINAL_KINDS[i] for i in follows.get(non_terminal, ())} - predicted
+        uses_actions = any(s is not None and s.startswith("#") for rule, _ in rules for s in rule)
+
+        emit("")
+        emit(f"    def {_method_name(non_terminal)}(self, n):")
+        emit("        tree = self.tree")
+        if uses_actions:
+            emit("        code_gen = self.code_gen")
+        emit("        while True:")
+        emit("            k = self.token_kind")
+        for i, (rule, kinds) in enumerate(rules):
+            keyword = "elif" if i else "if"
+            emit(f"            {keyword} {_kinds_test(kinds)}:  # {' '.join(s or 'EPSILON' for s in rule)}")
+            _emit_rule(emit, non_terminal, rule)
+        if syncs:
+            emit(f"            elif {_kinds_test(syncs)}:")
+            emit(f"                self._missing(n, {Parser._sanitize_non_terminal_name(non_terminal)!r})")
+            emit("                return")
+        emit("            else:")
+        emit(f"                self._illegal(n, _SKIP_{non_terminal})")
+
+    emit("")
+    emit(f"    _parse_start = {_method_name(non_terminals[0])}")
+    emit("")
+    return "\n".join(lines)
+
+
+def _emit_rule(emit, non_terminal: str, rule: list):
+    indent = " " * 16
+    if rule == [None]:
+        emit(f"{indent}if tree is not None:")
+        emit(f"{indent}    tree.add_children(n, ('epsilon',))")
+        emit(f"{indent}return")
+        return
+    labels = tuple(Parser._sanitize_non_terminal_name(s) for s in rule)
+    emit(f"{indent}c = tree.add_children(n, {labels!r}) if tree is not None else -1")
+    tail = len(rule) - 1 if rule[-1] == non_terminal else None
+    body = rule if tail is None else rule[:-1]
+    # a StopParsing raised by a terminal or non-terminal of the rule drops
+    # the siblings after it, which needs a try only if there are any
+    raising = [j for j, s in enumerate(body) if not s.startswith("#")]
+    guarded = any(j < len(rule) - 1 for j in raising)
+    inner = indent
+    if guarded:
+        emit(f"{indent}try:")
+        inner = indent + "    "
+    for j, symbol in enumerate(body):
+        if symbol.startswith("#"):
+            action = symbol[1:]
+            if action == "end_iterator_expression_mode":
+                emit(f"{inner}code_gen.{action}(self._token_pack)")
+            else:
+                # recorded rather than run while a for loop's iterator expression is read
+                emit(f"{inner}if code_gen.iterator_expression_mode:")
+                emit(f"{inner}    code_gen(code_gen.{action}, self._token_pack)")
+                emit(f"{inner}else:")
+                emit(f"{inner}    code_gen.{action}(self._token_pack)")
+            continue
+        if guarded:
+            emit(f"{inner}j = {j}")
+        if symbol in TERMINAL_KINDS:
+            emit(f"{inner}if self.token_kind == {TERMINAL_KINDS[symbol]}:  # {symbol}")
+            emit(f"{inner}    if tree is not None:")
+            emit(f"{inner}        tree.labels[c + {j}] = f\"({{self.token_type}}, {{self.token_id}})\"")
+            emit(f"{inner}    self._next_token()")
+            emit(f"{inner}else:")
+            emit(f"{inner}    self._missing(c + {j}, {symbol!r})")
+        else:
+            emit(f"{inner}self.{_method_name(symbol)}(c + {j})")
+    if guarded:
+        emit(f"{indent}except StopParsing:")
+        emit(f"{indent}    self._drop_pending(c + j + 1, c + {len(rule)})")
+        emit(f"{indent}    raise")
+    if tail is None:
+        emit(f"{indent}return")
+    else:
+        emit(f"{indent}n = c + {tail}")
+
+
+def load_generated_parser(path: str = "grammar.txt", cache_dir: Optional[str] = None) -> type:
+    """GeneratedParser class for the grammar at ``path``.
+
+    The compiled module is kept next to the grammar table (see
+    grammar.load_grammar), keyed by the grammar text, the generator version
+    and the Python version, so it is generated only once per grammar.
+    """
+    with open(path, "rb") as f:
+        source = f.read()
+    key = source + f"\0parsergen {GENERATOR_VERSION} {sys.implementation.cache_tag}".encode()
+    cache_path = cache_file(path, key, "parser", cache_dir)
+    code = read_cache(cache_path)
+    if code is None:
+        code = compile(generate_parser_source(load_grammar(path, cache_dir)), f"<parser for {path}>", "exec")
+        write_cache(cache_path, code)
+    namespace = {"__name__": "generated_parser"}
+    exec(code, namespace)
+    return namespace["GeneratedParser"]
+
+
+def parse_program(parser: Parser) -> Optional[Exception]:
+    """Run ``parser``, returning the error the code generator gave up with on
+    an erroneous program, if it did."""
+    try:
+        parser.parse()
+    except CodeGenerator.ACTION_ERRORS as e:
+        return e
+    return None
+
+
+def benchmark(input_path: str, grammar_path: str = "grammar.txt", repeat: int = 5, build_tree: bool = True):
+    """Best of ``repeat`` compiles of ``input_path`` with the table-driven
+    Parser and the generated parser, writing to in-memory streams."""
+    from scanner import Scanner
+
+    with open(input_path) as f:
+        text = f.read()
+    grammar = load_grammar(grammar_path)
+    results = {}
+    for name, parser_class in (("table", Parser), ("generated", load_generated_parser(grammar_path))):
+        best = None
+        for _ in range(repeat):
+            scanner = Scanner(io.StringIO(text), io.StringIO(), io.StringIO())
+            code_gen = CodeGenerator(io.StringIO(), io.StringIO(), scanner)
+            parser = parser_class(scanner, code_gen, grammar, io.StringIO(), io.StringIO(), build_tree)
+            start = time.perf_counter()
+            parse_program(parser)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Print the generated parser for a grammar, or benchmark it against the table-driven one."
+    )
+    arg_parser.add_argument("grammar", nargs="?", default="grammar.txt")
+    arg_parser.add_argument("--benchmark", metavar="INPUT", help="time both parsers on this C-minus file")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--no-parse-tree", dest="parse_tree", action="store_false")
+    args = arg_parser.parse_args()
+    if args.benchmark:
+        times = benchmark(args.benchmark, args.grammar, args.repeat, args.parse_tree)
+        print(f"table-driven: {times['table']:.3f}s")
+        print(f"generated:    {times['generated']:.3f}s ({times['table'] / times['generated']:.2f}x)")
+    else:
+        print(generate_parser_source(load_grammar(args.grammar)))
+
+
+if __name__ == "__main__":
+    main()
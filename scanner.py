@@ -1,3 +1,7 @@
+import re
+import string
+from typing import Dict, Optional
+
 from consts import *
 from language import DFA, build_dfa
 
@@ -8,76 +12,219 @@ class EndOfFileException(Exception):
     pass
 
 
+class SourceBuffer:
+    """Whole input held in memory with lazily counted line numbers.
+
+    Newlines are counted in bulk with ``str.count`` only when a line number is
+    asked for, instead of being tracked on every character.
+    """
+
+    def __init__(self, input_stream):
+        self.text = input_stream.read()
+        self.length = len(self.text)
+        self._line_pos = 0
+        self._line_count = 1
+
+    def slice(self, start, end) -> str:
+        """Text between two offsets; offset ``length`` is the end marker ``$``."""
+        if end > self.length:
+            return self.text[start:self.length] + '$'
+        return self.text[start:end]
+
+    def lineno_at(self, pos) -> int:
+        """Line number of the character at ``pos``."""
+        pos = min(max(pos, 0), self.length)
+        if pos >= self._line_pos:
+            self._line_count += self.text.count('\n', self._line_pos, pos)
+        else:
+            self._line_count -= self.text.count('\n', pos, self._line_pos)
+        self._line_pos = pos
+        return self._line_count
+
+
+class Token:
+    __slots__ = ('token_type', 'kind', 'start', 'end', '_source', '_lexeme')
+
+    def __init__(self, token_type: TokenType, kind: int, source: Optional[SourceBuffer], start: int, end: int,
+                 lexeme=None):
+        self.token_type = token_type
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self._source = source
+        self._lexeme = lexeme
+
+    @property
+    def lexeme(self) -> str:
+        if self._lexeme is None:
+            self._lexeme = self._source.slice(self.start, self.end)
+        return self._lexeme
+
+
 class Scanner:
-    identifiers = []
     dfa = DFA()
     QUIET_ACCEPTS = (TokenType.COMMENT, TokenType.WHITESPACE)
+    # groups: 1 id/keyword, 2 number, 3 symbol, 4 comment opener, 5 end of file
+    FAST_PATH_PATTERN = re.compile(
+        r'[ \n\r\t\v\f]*(?:([A-Za-z][A-Za-z0-9]*)|([0-9]+)|(==|[;:,\[\](){}+\-<*=])|(/\*)|(\$))'
+    )
+    _VALID_INPUTS = frozenset(VALID_INPUTS)
+    _LETTERS = frozenset(string.ascii_letters)
 
-    def __init__(self, input_stream, errors_stream, symbols_stream):
+    def __init__(self, input_stream, errors_stream, symbols_stream, fast_path=True):
         self.input_stream = input_stream
+        self.fast_path = fast_path
+        self.source = SourceBuffer(input_stream)
         self.errors_stream = errors_stream
         self.symbols_stream = symbols_stream
-        self.lineno = 1
+        self.identifiers: Dict[str, int] = {}
+        self.pos = 0
         self.unclosed_comment_lineno = 0
         self.last_error_lineno = 0
         self.last_token_lineno = 0
-        self.current_token_lexeme = ''
+        self.token_start = 0
         self.symbol_line = 1
-        self._input_ended = False
-        self._returned_eof = False
-        self._input_endline = False
         self.look_ahead = None
         self._token_generator = self._get_next_token()
         for keyword in KEYWORDS:
             self._write_to_symbol_table(keyword)
 
+    def seek(self, pos):
+        """Continue lexing at ``pos`` from the DFA start state."""
+        self.pos = pos
+        self.token_start = pos
+        self._token_generator = self._get_next_token()
+
     def get_next_token(self):
 
         return next(self._token_generator)
 
     def _get_next_token(self):
+        table = self.dfa.table
+        transitions, consumes = table.transitions, table.consumes
+        accepts, errors, on_enters = table.accepts, table.errors, table.on_enters
+        char_classes, other_class = table.char_classes, table.other_class
         char = self.read_char()
-        state = self.dfa.get_state('start')
+        state = table.start
+        if self.fast_path:
+            char = yield from self._fast_path_tokens()
         while True:
-            state.on_enter(self)
-            if state.accept:
-                accept_result = self.on_accept(state.accept)
-                self.current_token_lexeme = ''
-                state = self.dfa.get_state('start')
-                if accept_result is not None:
-                    yield accept_result[0], accept_result[1]
-            elif state.error:
-                self.error_handler(state.error)
-                self.current_token_lexeme = ''
-                state = self.dfa.get_state('start')
+            on_enter = on_enters[state]
+            if on_enter is not None:
+                on_enter(self)
+            if accepts[state]:
+                token = self.on_accept(accepts[state])
+                self.token_start = self.pos - 1
+                state = table.start
+                if token is not None:
+                    yield token
+                if self.fast_path:
+                    char = yield from self._fast_path_tokens()
+            elif errors[state]:
+                self.error_handler(errors[state])
+                state = table.start
                 char = self.read_char()
+                self.token_start = self.pos - 1
+                if self.fast_path:
+                    char = yield from self._fast_path_tokens()
             elif char is None:
-                self.current_token_lexeme = ''
                 raise EndOfFileException()
             else:
-                edge = state.next(char)
-                if edge.consume_char:
-                    self.current_token_lexeme += char
+                char_class = char_classes.get(char, other_class)
+                if consumes[state][char_class]:
                     char = self.read_char()
-                state = edge.to()
+                state = transitions[state][char_class]
+                if state < 0:
+                    raise Exception('no edge found')
 
-    def read_char(self):
-        if self._input_ended:
-            return None
+    def _fast_path_tokens(self):
+        """Tokenize from the current character with FAST_PATH_PATTERN.
 
-        if self._input_endline:
-            self.lineno += 1
-            self._input_endline = False
+        Stops in front of anything the DFA has to judge (invalid input, invalid
+        numbers, unmatched or unclosed comments, the end of input) and returns
+        that character so the DFA can take over from its start state.
+        """
+        text = self.source.text
+        length = self.source.length
+        match = self.FAST_PATH_PATTERN.match
+        valid_inputs, letters = self._VALID_INPUTS, self._LETTERS
+        i = self.pos - 1
+        while i < length:
+            m = match(text, i)
+            if m is None:
+                break
+            kind = m.lastindex
+            start, end = m.span(kind)
+            following = text[end] if end < length else '$'
+            if kind == 1:
+                if following not in valid_inputs:
+                    i = start
+                    break
+                token_type = TokenType.ID_OR_KEYWORD
+            elif kind == 2:
+                if following in letters:
+                    i = start
+                    break
+                token_type = TokenType.NUM
+            elif kind == 3:
+                if end - start == 1 and (
+                        (text[start] == '=' and following not in valid_inputs)
+                        or (text[start] == '*' and (following == '/' or following not in valid_inputs))
+                ):
+                    i = start
+                    break
+                token_type = TokenType.SYMBOL
+            elif kind == 4:
+                comment_end = self._find_comment_end(text, end)
+                if comment_end < 0:
+                    i = start
+                    break
+                i = comment_end
+                continue
+            else:
+                token_type = TokenType.END_OF_FILE
+            self.token_start = start
+            self.pos = end + 1
+            yield self.on_accept(token_type)
+            i = end
+        self.pos = i
+        char = self.read_char()
+        self.token_start = self.pos - 1
+        return char
 
-        c = self.input_stream.read(1)
-        if not c:
-            self._input_ended = True
-            return '$'
+    @staticmethod
+    def _find_comment_end(text, pos) -> int:
+        """Offset just past the ``*/`` closing a comment whose body starts at ``pos``, or -1.
 
-        if c == '\n':
-            self._input_endline = True
+        Mirrors the DFA: the character after any ``*`` in a comment is consumed
+        with it, so ``**/`` does not close the comment.
+        """
+        while True:
+            star = text.find('*', pos)
+            if star < 0 or star + 1 >= len(text):
+                return -1
+            if text[star + 1] == '/':
+                return star + 2
+            pos = star + 2
+
+    @property
+    def lineno(self) -> int:
+        return self.source.lineno_at(self.pos - 1)
+
+    def read_char(self):
+        pos = self.pos
+        if pos < self.source.length:
+            self.pos = pos + 1
+            return self.source.text[pos]
+        if pos == self.source.length:
+            self.pos = pos + 1
+            return '$'
+        self.pos = self.source.length + 2
+        return None
 
-        return c
+    @property
+    def current_token_lexeme(self) -> str:
+        return self.source.slice(self.token_start, self.pos - 1)
 
     def error_handler(self, error: ScannerErrorType):
         if error == ScannerErrorType.INVALID_INPUT:
@@ -90,23 +237,38 @@ class Scanner:
         elif error == ScannerErrorType.INVALID_NUMBER:
             self._write_to_errors(f'({self.current_token_lexeme}, Invalid number) ', self.lineno)
 
-    def token_generator(self, token: TokenType):
-        return str(token.name), self.current_token_lexeme
+    def token_generator(self, token: TokenType, lexeme=None):
+        if token == TokenType.ID or token == TokenType.NUM:
+            kind = TERMINAL_KINDS[token.name]
+        elif token == TokenType.END_OF_FILE:
+            kind = TERMINAL_KINDS['$']
+        else:
+            if lexeme is None:
+                lexeme = self.current_token_lexeme
+            kind = TERMINAL_KINDS[lexeme]
+        return Token(token, kind, self.source, self.token_start, self.pos - 1, lexeme)
 
     def on_accept(self, token: TokenType):
         if token in self.QUIET_ACCEPTS:
             return None
 
         if token == TokenType.ID_OR_KEYWORD:
-            if self.current_token_lexeme in KEYWORDS:
-                return self.token_generator(TokenType.KEYWORD)
+            lexeme = self.current_token_lexeme
+            if lexeme in KEYWORDS:
+                return self.token_generator(TokenType.KEYWORD, lexeme)
             else:
-                if self.current_token_lexeme not in self.identifiers:
-                    self.identifiers.append(self.current_token_lexeme)
-                    self._write_to_symbol_table(self.current_token_lexeme)
-                return self.token_generator(TokenType.ID)
+                self.intern(lexeme)
+                return self.token_generator(TokenType.ID, lexeme)
         return self.token_generator(token)
 
+    def intern(self, lexeme: str) -> int:
+        """Id of an identifier, numbered from 0 in order of first occurrence."""
+        identifier_id = self.identifiers.get(lexeme)
+        if identifier_id is None:
+            identifier_id = self.identifiers[lexeme] = len(self.identifiers)
+            self._write_to_symbol_table(lexeme)
+        return identifier_id
+
     def _write_to_errors(self, error_message, error_line):
 
         if error_line != self.last_error_lineno:
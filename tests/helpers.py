@@ -0,0 +1,43 @@
+"""Shared by the tests: the sample programs and a compile that keeps every output."""
+import io
+import os
+
+from codegen import CodeGenerator
+from grammar import load_grammar
+from parser import Parser
+from parsergen import parse_program
+from scanner import Scanner
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+GRAMMAR = os.path.join(os.path.dirname(TESTS), "grammar.txt")
+PROGRAMS = os.path.join(TESTS, "programs")
+
+
+def read_program(name: str) -> str:
+    with open(os.path.join(PROGRAMS, name)) as f:
+        return f.read()
+
+
+def compile_source(text: str, parser_class=Parser, stream_output=False, max_syntax_errors=None,
+                   tokens=None) -> dict:
+    """Every output file of compiling ``text``, by name, as compiler.py writes
+    them to in-memory streams; ``tokens`` replaces the scanner as the token
+    source, as a TokenBufferReader does for compiler.py -j."""
+    streams = {name: io.StringIO() for name in (
+        "lexical_errors", "symbol_table", "syntax_errors", "parse_tree", "output", "semantic_errors",
+    )}
+    scanner = Scanner(io.StringIO(text), streams["lexical_errors"], streams["symbol_table"])
+    if tokens is None:
+        tokens = scanner
+    elif callable(tokens):
+        tokens = tokens(scanner)
+    code_gen = CodeGenerator(streams["output"], streams["semantic_errors"], tokens, stream_output)
+    parser = parser_class(tokens, code_gen, load_grammar(GRAMMAR), streams["syntax_errors"],
+                          streams["parse_tree"], max_syntax_errors=max_syntax_errors)
+    try:
+        error = parse_program(parser)
+    finally:
+        code_gen.close()
+    result = {"exception": None if error is None else type(error).__name__}
+    result.update((name, stream.getvalue()) for name, stream in streams.items())
+    return result
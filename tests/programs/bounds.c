@@ -0,0 +1,11 @@
+int f(int x) { return x + 1; }
+void main(void) {
+    int a[2]; int b;
+    b = 7;
+    a[2] = 5;
+    a[0] = f(1);
+    output(b);
+    output(a[0]);
+    a[1] = 3;
+    output(a[1]);
+}
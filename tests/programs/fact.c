@@ -0,0 +1,15 @@
+/* factorial test */
+int fact(int n) {
+    if (n < 2) return 1; endif
+    return n * fact(n - 1);
+}
+
+void main(void) {
+    int i;
+    int a[10];
+    for (i = 0; i < 6; i = i + 1) {
+        a[i] = fact(i);
+        output(a[i]);
+    }
+    output(a[5] - a[4]);
+}
@@ -0,0 +1,32 @@
+int fib(int n) {
+    if (n < 2) return n; endif
+    return fib(n - 1) + fib(n - 2);
+}
+int g;
+int arr[5];
+void fill(int x[], int n) {
+    int i;
+    for (i = 0; i < n; i = i + 1) x[i] = i * i;
+}
+int sum(int x[], int n) {
+    int i; int s;
+    s = 0;
+    for (i = 0; i < n; i = i + 1) {
+        if (i == 3) break; endif
+        s = s + x[i];
+    }
+    return s;
+}
+void main(void) {
+    int k;
+    g = 7;
+    output(fib(10));
+    fill(arr, 5);
+    output(sum(arr, 5));
+    k = -g + 3 * 2 - (4 - 1);
+    output(k);
+    if (k < 0) output(1); else output(0); endif
+    output(arr[2] + arr[4]);
+    k = 2;
+    output(k * k * k + fib(k + 3) * 2);
+}
@@ -0,0 +1,12 @@
+void main(void) {
+    int a1b;
+    int 12ab;
+    a1b = 5 @ 3;
+    /* ok comment */
+    a1b = 3 */ 2;
+    x = y / z;
+    output(a1b); ?
+    int b#;
+}
+/* unclosed comment going on
+and on
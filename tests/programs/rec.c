@@ -0,0 +1,56 @@
+int g;
+int gcd(int a, int b) {
+    if (b == 0) return a; endif
+    if (a < b) return gcd(b, a); endif
+    return gcd(a - b, b);
+}
+int pw(int b, int e) {
+    int half; int r;
+    if (e == 0) return 1; endif
+    half = pw(b, e - 1);
+    r = half;
+    return b * r;
+}
+int ack(int m, int n) {
+    if (m == 0) return n + 1; endif
+    if (n == 0) return ack(m - 1, 1); endif
+    return ack(m - 1, ack(m, n - 1));
+}
+int sumto(int n) {
+    int t; int u;
+    t = n;
+    u = 5;
+    if (n == 0) return 0; endif
+    u = sumto(n - 1);
+    return t + u;
+}
+int tri(int x[], int n) {
+    int i; int acc;
+    acc = 0;
+    if (n == 0) return 0; endif
+    for (i = 0; i < n; i = i + tri(x, 0) + 1) {
+        acc = acc + x[i];
+    }
+    return acc + tri(x, n - 1);
+}
+int cnt(int n) {
+    g = g + 1;
+    if (n < 1) return 0; endif
+    return cnt(n - 1) + cnt(n - 2) + 1;
+}
+void main(void) {
+    int a[6]; int i; int z;
+    for (i = 0; i < 6; i = i + 1) a[i] = i + 1;
+    output(ack(2, 3));
+    output(pw(3, 5));
+    output(sumto(10));
+    output(tri(a, 6));
+    z = 3;
+    z = sumto(z) + z;
+    output(z);
+    g = 0;
+    output(cnt(6));
+    output(g);
+    if (sumto(3) == 6) output(1); else output(0); endif
+    output(sumto(sumto(3)) + sumto(2) * sumto(1));
+}
@@ -0,0 +1,31 @@
+int x;
+int h(int x) {
+    int y;
+    y = x + 1;
+    {
+        int x;
+        x = y * 2;
+        output(x);
+    }
+    return x + y;
+}
+int rec(int n, int acc[]) {
+    int t;
+    if (n == 0) return 0; endif
+    t = n + rec(n - 1, acc);
+    acc[n] = t;
+    return t;
+}
+void main(void) {
+    int a[20];
+    int i;
+    x = 5;
+    output(h(x));
+    output(x);
+    output(rec(6, a));
+    for (i = 1; i < 7; i = i + 1) output(a[i]);
+    for (i = 0; i < 100; i = i + 1) {
+        if (i == 4) break; else output(i * 10); endif
+    }
+    output((1 + 2) * (3 - 4) < 0 == 1);
+}
@@ -0,0 +1,18 @@
+int g;
+int bump(int n) {
+    g = g + n;
+    return g;
+}
+void main(void) {
+    int a; int i;
+    a = 3;
+    bump(a);
+    a + 1;
+    a * (bump(2) + 1);
+    for (i = 0; i < 3; i = i + 1) {
+        bump(i) < a;
+        if (i == 1) a = a + i; else bump(1); endif
+    }
+    output(g);
+    output(a);
+}
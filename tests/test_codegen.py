@@ -0,0 +1,202 @@
+import io
+import re
+
+import pytest
+
+import codegen
+from codegen import CodeGenerator
+from consts import MODE_CONST, MODE_DIRECT, MODE_INDIRECT, MODE_NONE, OP_ADD, OP_ASSIGN, OP_JP, OP_JPF, OP_PRINT
+from helpers import compile_source, read_program
+from util import Code, ProgramBlock, operand
+from vm import run
+
+RUNNABLE = ["fib.c", "scopes.c", "rec.c", "fact.c", "bounds.c", "stores.c"]
+# programs that call every function they declare
+ALL_CALLED = ["fib.c", "scopes.c", "fact.c", "bounds.c", "stores.c"]
+EXPECTED = {
+    "fib.c": [55, 5, -4, 1, 20, 18],
+    "fact.c": [1, 1, 2, 6, 24, 120, 96],
+    # a[2] is out of bounds and writes b
+    "bounds.c": [5, 2, 3],
+    "stores.c": [10, 4],
+}
+
+
+def assert_same_output_without(monkeypatch, name, owner, attribute, replacement):
+    """The program ``name`` must print the same with ``owner.attribute``, an
+    optimization, replaced by ``replacement``, and take no more code."""
+    optimized = compile_source(read_program(name))["output"]
+    monkeypatch.setattr(owner, attribute, replacement)
+    reference = compile_source(read_program(name))["output"]
+    assert len(optimized.splitlines()) <= len(reference.splitlines())
+    assert run(optimized) == run(reference)
+
+
+@pytest.mark.parametrize("name", RUNNABLE)
+def test_dropping_dead_spills_keeps_output(name, monkeypatch):
+    assert_same_output_without(monkeypatch, name, CodeGenerator, "_drop_dead_spills", lambda self, func: None)
+
+
+@pytest.mark.parametrize("name", RUNNABLE)
+def test_peephole_keeps_output(name, monkeypatch):
+    assert_same_output_without(monkeypatch, name, codegen, "peephole", lambda *args: None)
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED))
+def test_program_output(name):
+    assert run(compile_source(read_program(name))["output"]) == EXPECTED[name]
+
+
+@pytest.mark.parametrize("name", RUNNABLE)
+def test_constant_folding_keeps_output(name, monkeypatch):
+    assert_same_output_without(monkeypatch, name, CodeGenerator, "_push_folded", lambda self, *args: False)
+
+
+@pytest.mark.parametrize("name", RUNNABLE)
+def test_temp_allocation_keeps_output(name, monkeypatch):
+    assert_same_output_without(monkeypatch, name, CodeGenerator, "_allocate_temps", lambda self, func: None)
+
+
+@pytest.mark.parametrize("name", RUNNABLE)
+def test_dropping_dead_stores_keeps_output(name, monkeypatch):
+    assert_same_output_without(monkeypatch, name, CodeGenerator, "_drop_dead_stores", lambda self, func: None)
+
+
+def test_parameter_declaration_cut_short():
+    # the parameter list leaves a None in the symbol table
+    result = compile_source("int f ( int return , ) { return 1; } void main(void) { output(2); }")
+    assert result["exception"] is None
+    assert run(result["output"]) == [2]
+
+
+def test_program_block_packing():
+    pb = ProgramBlock()
+    codes = [
+        Code(OP_ASSIGN, operand(MODE_CONST, -3), operand(MODE_DIRECT, 500)),
+        Code(OP_ADD, operand(MODE_INDIRECT, 504), operand(MODE_CONST, 4), operand(MODE_DIRECT, 508)),
+        Code(OP_JPF, operand(MODE_DIRECT, 508), MODE_NONE),
+        Code(OP_PRINT, operand(MODE_DIRECT, 512)),
+    ]
+    for code in codes:
+        pb.append(code)
+    assert [(pb[i].op, pb[i].a, pb[i].b, pb[i].c) for i in range(len(pb))] == [
+        (code.op, code.a, code.b, code.c) for code in codes
+    ]
+    pb.patch_jump(2, operand(MODE_DIRECT, 3))
+    out = io.StringIO()
+    pb.write(out)
+    assert out.getvalue() == (
+        "0\t(ASSIGN, #-3, 500, )\n"
+        "1\t(ADD, @504, #4, 508)\n"
+        "2\t(JPF, 508, 3, )\n"
+        "3\t(PRINT, 512, , )\n"
+    )
+
+
+def compile_streamed(text: str) -> dict:
+    """compile_source with stream_output, the jump to main written as
+    without it rather than padded."""
+    result = compile_source(text, stream_output=True)
+    result["output"] = re.sub(r"^1\t\(JP, 0*(\d)", r"1\t(JP, \1", result["output"], flags=re.M)
+    return result
+
+
+@pytest.mark.parametrize("name", ALL_CALLED)
+def test_stream_output_matches(name):
+    text = read_program(name)
+    assert compile_streamed(text) == compile_source(text)
+
+
+def test_stream_output_pads_jump_to_main():
+    text = read_program("fib.c")
+    assert "1\t(JP, 0000000065, , )\n" in compile_source(text, stream_output=True)["output"]
+    assert "1\t(JP, 65, , )\n" in compile_source(text)["output"]
+
+
+def test_stream_output_keeps_functions_never_called():
+    text = read_program("rec.c")
+    streamed, whole = compile_streamed(text), compile_source(text)
+    assert len(streamed["output"].splitlines()) > len(whole["output"].splitlines())
+    assert run(streamed["output"]) == run(whole["output"])
+    del streamed["output"], whole["output"]
+    assert streamed == whole
+
+
+@pytest.mark.parametrize("text", [
+    "int f(int x) { return x; } void main(void) { y = 1; }",
+    "int f(int x) { return x; } void main(void) { f(1); ",
+])
+def test_stream_output_of_failed_program(text):
+    assert compile_streamed(text) == compile_source(text)
+
+
+@pytest.mark.parametrize("text", [
+    "int f(int a) { if (a) output(1); endif return a; } void main(void) { output(f(1)); }",
+    # the missing endif leaves the JPF unpatched, and f is kept in memory
+    "int f(int a) { if (a) output(1); return a; } int g(int b) { return b; } void main(void) { output(f(g(1))); }",
+])
+def test_stream_output_with_if_without_else(text):
+    streamed, whole = compile_streamed(text), compile_source(text)
+    assert streamed["exception"] is None
+    assert streamed == whole
+
+
+def fill_block(pb, flush=None):
+    """The prologue with its jump to main, then 20 PRINTs, flushed to
+    ``flush`` every 8 instructions if it is given."""
+    pb.append(Code(OP_ASSIGN, operand(MODE_CONST, 4), operand(MODE_DIRECT, 0)))
+    pb.append(Code(OP_JP, MODE_NONE))
+    pb.defer(1)
+    for i in range(20):
+        pb.append(Code(OP_PRINT, operand(MODE_DIRECT, 500 + 4 * i)))
+        if flush is not None and i % 8 == 7:
+            pb.flush(flush)
+
+
+@pytest.mark.parametrize("in_file", [False, True])
+def test_flush_and_close_match_write(in_file, tmp_path):
+    whole = ProgramBlock()
+    fill_block(whole)
+    whole.patch_jump(1, operand(MODE_DIRECT, 12))
+    expected = io.StringIO()
+    whole.write(expected)
+    assert "1\t(JP, 0000000012, , )\n" in expected.getvalue()
+
+    out = open(tmp_path / "output.txt", "w+") if in_file else io.StringIO()
+    streamed = ProgramBlock()
+    fill_block(streamed, out)
+    # flushed lines are written before the jump is patched
+    out.seek(0)
+    assert out.read().count("\n") == streamed.base == 18
+    out.seek(0, 2)
+    streamed.patch_jump(1, operand(MODE_DIRECT, 12))
+    streamed.close(out)
+    out.seek(0)
+    assert out.read() == expected.getvalue()
+    out.close()
+
+
+def test_constant_folding_overflow():
+    # the product does not fit a word, so it is computed at run time
+    result = compile_source("void main(void) { int x; x = 1000000 * 1000000 * 1000000 * 1000000; output(x); }")
+    assert result["exception"] is None
+    assert "MULT" in result["output"]
+    assert run(result["output"]) == [10 ** 24]
+
+
+@pytest.mark.parametrize("expression, value", [("-5", -5), ("2 - 5", -3)])
+def test_constant_folding_negative(expression, value):
+    result = compile_source(f"void main(void) {{ int x; x = {expression}; output(x); }}")
+    assert result["exception"] is None
+    assert "SUB" not in result["output"]
+    assert run(result["output"]) == [value]
+
+
+def test_oversized_literal():
+    result = compile_source("void main(void) { output(99999999999999999999); }")
+    assert result["exception"] is None
+    assert "#99999999999999999999" in result["output"]
+    assert run(result["output"]) == [99999999999999999999]
+    streamed = compile_source("int f(int a) { return a; } void main(void) { output(f(99999999999999999999)); }",
+                              stream_output=True)
+    assert run(streamed["output"]) == [99999999999999999999]
@@ -0,0 +1,35 @@
+import os
+
+from grammar import build_grammar, load_grammar
+from helpers import GRAMMAR
+
+
+def built_grammar():
+    with open(GRAMMAR) as f:
+        grammar = build_grammar(f.read())
+    return {key: grammar[key] for key in ("follows", "table", "non_terminals")}
+
+
+def test_cached_grammar_matches_built(tmp_path):
+    first = load_grammar(GRAMMAR, str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    assert first == built_grammar()
+    assert load_grammar(GRAMMAR, str(tmp_path)) == first
+
+
+def test_unreadable_cache_is_rebuilt(tmp_path):
+    load_grammar(GRAMMAR, str(tmp_path))
+    (path,) = tmp_path.iterdir()
+    path.write_bytes(b"not marshal data")
+    assert load_grammar(GRAMMAR, str(tmp_path)) == built_grammar()
+
+
+def test_changed_grammar_is_not_read_from_cache(tmp_path):
+    grammar_path = tmp_path / "grammar.txt"
+    with open(GRAMMAR) as f:
+        text = f.read()
+    grammar_path.write_text(text)
+    load_grammar(str(grammar_path))
+    grammar_path.write_text(text.rstrip("\n") + "\nUnused ID\n")
+    assert "Unused" in load_grammar(str(grammar_path))["table"]
+    assert len(os.listdir(tmp_path / "__pycache__")) == 2
@@ -0,0 +1,55 @@
+import io
+import random
+
+import pytest
+
+from parse_tree import ParseTree
+
+anytree = pytest.importorskip("anytree")
+
+
+def random_trees(seed, count):
+    """Pairs of a ParseTree and the same tree of anytree nodes, built by
+    random child appends and detaches."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        tree = ParseTree()
+        root = tree.add_node("Program")
+        nodes = {root: anytree.Node("Program")}
+        for _ in range(rng.randint(0, 60)):
+            parent = rng.choice(list(nodes))
+            if rng.random() < 0.5:
+                labels = [f"n{len(tree) + k}" for k in range(rng.randint(1, 3))]
+                first = tree.add_children(parent, labels)
+                for k, label in enumerate(labels):
+                    nodes[first + k] = anytree.Node(label, parent=nodes[parent])
+            elif rng.random() < 0.8 or parent == root:
+                child = tree.add_node(f"n{len(tree)}")
+                tree.append_child(parent, child)
+                nodes[child] = anytree.Node(tree.labels[child], parent=nodes[parent])
+            else:
+                tree.detach(parent)
+                nodes[parent].parent = None
+                detached = {node for node in nodes if node == parent or nodes[parent] in nodes[node].ancestors}
+                for node in detached:
+                    del nodes[node]
+        yield tree, root, nodes[root]
+
+
+def test_render_matches_anytree(monkeypatch):
+    # write in many chunks
+    monkeypatch.setattr(ParseTree, "WRITE_CHUNK", 8)
+    for tree, root, node in random_trees(1, 200):
+        out = io.StringIO()
+        tree.render(root, out)
+        expected = "\n".join(f"{pre}{n.name}" for pre, _, n in anytree.RenderTree(node))
+        assert out.getvalue() == expected
+
+
+def test_render_depths_matches_anytree(monkeypatch):
+    monkeypatch.setattr(ParseTree, "WRITE_CHUNK", 8)
+    for tree, root, node in random_trees(2, 200):
+        out = io.StringIO()
+        tree.render_depths(root, out)
+        expected = "\n".join(f"{n.depth}\t{n.name}" for n in anytree.PreOrderIter(node))
+        assert out.getvalue() == expected
@@ -0,0 +1,56 @@
+import pytest
+
+from helpers import GRAMMAR, compile_source, read_program
+from parser import Parser
+from parsergen import load_generated_parser
+
+PROGRAMS = [
+    "void main(void) { int a; a = 1; output(a); }",
+    "void main(void) { } } int x ; return",
+    "void main(void) { int a a = ; if (a < ) output(1); endif }",
+    "int f(int x) { return x + ; } void main(void) { f(1 2); }",
+    "void main(void) { a = (1 + ; b = ] c = 2;; } int",
+    "void main(void) { for (i = 0; i < ; ) { break } }",
+    "int int void ; main ( { } ) ) x [ 1 ] ;",
+    "void main(void) { output(1);",
+    read_program("scopes.c"),
+    read_program("lex_err.c"),
+]
+
+
+def parse(parser_class, text, max_syntax_errors=None):
+    return compile_source(text, parser_class, max_syntax_errors=max_syntax_errors)
+
+
+@pytest.mark.parametrize("text", PROGRAMS)
+@pytest.mark.parametrize("max_syntax_errors", [None, 1, 2, 3])
+def test_generated_parser_matches_table_parser(text, max_syntax_errors):
+    generated = load_generated_parser(GRAMMAR)
+    assert parse(generated, text, max_syntax_errors) == parse(Parser, text, max_syntax_errors)
+
+
+def test_error_cap_stops_reporting():
+    result = parse(Parser, PROGRAMS[4], max_syntax_errors=1)
+    assert result["syntax_errors"].count("syntax error") == 1
+    # the rest of the input is still scanned
+    assert "c" in result["symbol_table"].split()
+
+
+def test_error_cap_below_one_is_rejected():
+    with pytest.raises(ValueError):
+        parse(Parser, PROGRAMS[0], max_syntax_errors=0)
+
+
+def test_generated_parser_base_needs_a_generated_subclass():
+    from parsergen import GeneratedParserBase
+
+    with pytest.raises(TypeError):
+        parse(GeneratedParserBase, PROGRAMS[0])
+
+
+def test_cached_generated_parser(tmp_path):
+    text = read_program("scopes.c")
+    built = load_generated_parser(GRAMMAR, str(tmp_path))
+    cached = load_generated_parser(GRAMMAR, str(tmp_path))
+    assert cached is not built
+    assert parse(cached, text) == parse(built, text)
@@ -0,0 +1,109 @@
+import io
+import random
+
+import pytest
+
+from helpers import compile_source, read_program
+from scanner import EndOfFileException, Scanner
+from tokens import TokenBuffer
+
+SOURCES = [
+    read_program("fib.c"),
+    read_program("scopes.c"),
+    read_program("lex_err.c"),
+    "",
+    "\n\n  \t",
+    "a/b /* a\n comment */ c==d=e; x1 = 1x; */ @ ?\n",
+    "int a; /* unclosed\n\n",
+    "if(a<b)x=12;else y[3]=a*-1;endif /",
+    "a\n*/\n/\n*\n@\n#",
+]
+
+
+def scan(text, fast_path):
+    """Tokens, line numbers, lexical errors and symbol table of scanning ``text``."""
+    errors, symbols = io.StringIO(), io.StringIO()
+    scanner = Scanner(io.StringIO(text), errors, symbols, fast_path)
+    tokens = []
+    try:
+        while True:
+            token = scanner.get_next_token()
+            tokens.append((token.kind, token.lexeme, token.start, token.end, scanner.lineno))
+    except EndOfFileException:
+        pass
+    return tokens, scanner.lineno, errors.getvalue(), symbols.getvalue()
+
+
+def signature(buffer):
+    return [
+        (token.kind, token.lexeme, token.start, token.end, lineno)
+        for token, lineno in zip(buffer, buffer.linenos)
+    ], buffer.end_lineno, buffer.lexical_errors
+
+
+def replay(buffer, text):
+    """What scanning ``text`` writes, replayed from ``buffer``."""
+    errors, symbols = io.StringIO(), io.StringIO()
+    reader = buffer.reader(Scanner(io.StringIO(text), errors, symbols))
+    tokens = []
+    try:
+        while True:
+            token = reader.get_next_token()
+            tokens.append((token.kind, token.lexeme, token.start, token.end, reader.lineno))
+    except EndOfFileException:
+        pass
+    return tokens, reader.lineno, errors.getvalue(), symbols.getvalue()
+
+
+def random_source(rng, length):
+    pieces = ["int", "x", "a1", "12", " ", "\n", ";", "=", "==", "<", "*", "/", "/*", "*/", "(", ")",
+              "{", "}", "@", "#", "if", "endif"]
+    return "".join(rng.choice(pieces) for _ in range(length))
+
+
+@pytest.mark.parametrize("text", SOURCES)
+def test_fast_path_matches_dfa(text):
+    assert scan(text, True) == scan(text, False)
+
+
+@pytest.mark.parametrize("text", SOURCES)
+def test_token_buffer_replays_scanner(text):
+    assert replay(TokenBuffer.lex(text), text) == scan(text, True)
+
+
+@pytest.mark.parametrize("text", SOURCES)
+def test_dump_and_load(text):
+    buffer = TokenBuffer.lex(text)
+    dumped = io.BytesIO()
+    buffer.dump(dumped)
+    dumped.seek(0)
+    loaded = TokenBuffer.load(dumped)
+    assert signature(loaded) == signature(buffer)
+    assert replay(loaded, text) == scan(text, True)
+
+
+@pytest.mark.parametrize("name", ["fib.c", "scopes.c", "lex_err.c"])
+def test_compile_from_token_buffer(name):
+    text = read_program(name)
+    assert compile_source(text, tokens=lambda scanner: TokenBuffer.lex(text).reader(scanner)) == compile_source(text)
+
+
+def test_relex_matches_lex():
+    rng = random.Random(6)
+    for _ in range(200):
+        old = random_source(rng, rng.randint(0, 60))
+        start = rng.randint(0, len(old))
+        end = rng.randint(start, min(len(old), start + 8))
+        inserted = random_source(rng, rng.randint(0, 3))
+        new = old[:start] + inserted + old[end:]
+        relexed = TokenBuffer.lex(old).relex(new, [(start, end, len(inserted))])
+        assert signature(relexed) == signature(TokenBuffer.lex(new)), (old, new)
+
+
+def test_lex_parallel_matches_lex():
+    rng = random.Random(7)
+    texts = SOURCES + [random_source(rng, 300) for _ in range(5)]
+    for text in texts:
+        # small chunks, so most texts are split across the pool
+        parallel = TokenBuffer.lex_parallel(text, 3, min_chunk_size=16)
+        assert signature(parallel) == signature(TokenBuffer.lex(text)), text
@@ -0,0 +1,53 @@
+"""Interpreter for the three-address code in output.txt."""
+from typing import Dict, List
+
+MAX_STEPS = 1_000_000
+
+
+def run(code: str, max_steps: int = MAX_STEPS) -> List[int]:
+    """Values printed by the program, or a RuntimeError if it does not stop."""
+    program = {}
+    for line in code.splitlines():
+        index, instruction = line.split("\t")
+        program[int(index)] = [part.strip() for part in instruction[1:-1].split(",")]
+    memory: Dict[int, int] = {}
+
+    def value(operand: str) -> int:
+        if operand.startswith("#"):
+            return int(operand[1:])
+        return memory.get(address(operand), 0)
+
+    def address(operand: str) -> int:
+        if operand.startswith("@"):
+            return memory.get(int(operand[1:]), 0)
+        return int(operand)
+
+    printed = []
+    pc = 0
+    for _ in range(max_steps):
+        if pc not in program:
+            return printed
+        op, a, b, c = program[pc]
+        pc += 1
+        if op == "ADD":
+            memory[address(c)] = value(a) + value(b)
+        elif op == "SUB":
+            memory[address(c)] = value(a) - value(b)
+        elif op == "MULT":
+            memory[address(c)] = value(a) * value(b)
+        elif op == "EQ":
+            memory[address(c)] = int(value(a) == value(b))
+        elif op == "LT":
+            memory[address(c)] = int(value(a) < value(b))
+        elif op == "ASSIGN":
+            memory[address(b)] = value(a)
+        elif op == "JP":
+            pc = address(a)
+        elif op == "JPF":
+            if not value(a):
+                pc = address(b)
+        elif op == "PRINT":
+            printed.append(value(a))
+        else:
+            raise ValueError(f"unknown instruction {op}")
+    raise RuntimeError(f"program did not stop in {max_steps} steps")
@@ -0,0 +1,365 @@
+import io
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from consts import KEYWORDS, TERMINAL_KINDS, TERMINALS, TokenType
+from scanner import EndOfFileException, Scanner, Token
+
+
+def _terminal_token_type(terminal: str) -> TokenType:
+    if terminal == "$":
+        return TokenType.END_OF_FILE
+    if terminal in (TokenType.ID.name, TokenType.NUM.name):
+        return TokenType[terminal]
+    if terminal in KEYWORDS:
+        return TokenType.KEYWORD
+    return TokenType.SYMBOL
+
+
+KIND_TOKEN_TYPES = tuple(_terminal_token_type(terminal) for terminal in TERMINALS)
+
+
+class TokenBuffer:
+    """Token stream of one source kept in parallel arrays.
+
+    Per token it stores the terminal kind, an id into an interned lexeme
+    table, the line number the parser reports while the token is its
+    lookahead, and the token's start/end offsets in the source.
+    """
+
+    MAGIC = b"CMTB"
+    VERSION = 2
+    _HEADER = struct.Struct("<4sHIIII")
+    _ERROR = struct.Struct("<III")
+
+    def __init__(self):
+        self.kinds = array("B")
+        self.lexeme_ids = array("I")
+        self.linenos = array("I")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.lexemes: List[str] = []
+        self._lexeme_table: Dict[str, int] = {}
+        self.end_lineno = 1
+        # (start offset, line, message) of lexical errors, for buffers lexed from text
+        self.lexical_errors: List[Tuple[int, int, str]] = []
+
+    @classmethod
+    def from_scanner(cls, scanner: Scanner) -> "TokenBuffer":
+        buffer = cls()
+        try:
+            while True:
+                token = scanner.get_next_token()
+                buffer.append(token, scanner.lineno)
+        except EndOfFileException:
+            pass
+        buffer.end_lineno = scanner.lineno
+        return buffer
+
+    @classmethod
+    def lex(cls, text: str, fast_path=True) -> "TokenBuffer":
+        """Token buffer of ``text``, keeping its lexical errors in ``lexical_errors``."""
+        scanner = _RecordingScanner(text, fast_path)
+        buffer = cls.from_scanner(scanner)
+        buffer.lexical_errors = scanner.errors
+        return buffer
+
+    @classmethod
+    def lex_parallel(cls, text: str, processes: Optional[int] = None, fast_path=True,
+                     min_chunk_size=1 << 16) -> "TokenBuffer":
+        """Like lex, but lexes newline-aligned chunks of ``text`` in a process pool.
+
+        Every chunk is lexed as if the DFA were in its start state at the
+        chunk's first character. That holds for the next chunk only if this
+        one produces its end-of-file token right at its end; otherwise (an
+        unclosed ``/*`` or an error swallowing the newline) lexing goes on
+        sequentially from the chunk's last token until it ends a token where
+        a later chunk did, and continues with that chunk's tokens.
+        """
+        processes = processes or os.cpu_count() or 1
+        bounds = _split_lines(text, max(min_chunk_size, -(-len(text) // processes)))
+        if len(bounds) <= 2:
+            return cls.lex(text, fast_path)
+        chunks = [text[bounds[k]:bounds[k + 1]] for k in range(len(bounds) - 1)]
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(cls.lex, chunks, repeat(fast_path)))
+        line_deltas = [0]
+        for chunk in chunks[:-1]:
+            line_deltas.append(line_deltas[-1] + chunk.count("\n"))
+
+        buffer = cls()
+        last = len(chunks) - 1
+        k, begin, errors_from = 0, 0, 0
+        while True:
+            chunk = results[k]
+            offset, line_delta = bounds[k], line_deltas[k]
+            clean = k == last or (
+                len(chunk) > 0
+                and chunk.kinds[-1] == TERMINAL_KINDS["$"]
+                and chunk.starts[-1] == len(chunks[k])
+            )
+            end = len(chunk) - 1 if clean and k != last else len(chunk)
+            lexeme_map = [buffer._intern(lexeme) for lexeme in chunk.lexemes]
+            buffer._extend(chunk, begin, end, offset, line_delta, lexeme_map)
+            if clean:
+                errors_to = bounds[k + 1] if k != last else len(text) + 1
+            else:
+                errors_to = chunk.ends[end - 1] + offset if end > begin else errors_from
+            buffer._extend_errors(chunk.lexical_errors, errors_from - offset, errors_to - offset, offset, line_delta)
+            if k == last:
+                buffer.end_lineno = chunk.end_lineno + line_delta
+                return buffer
+            if clean:
+                k, begin, errors_from = k + 1, 0, bounds[k + 1]
+                continue
+
+            # the next chunk did not start in the start state, go on sequentially from here
+            sequential = _RecordingScanner(text, fast_path)
+            sequential.seek(errors_to)
+            resync = None
+            try:
+                while resync is None:
+                    token = sequential.get_next_token()
+                    buffer.append(token, sequential.lineno)
+                    j = min(bisect_right(bounds, token.start) - 1, last)
+                    if j <= k:
+                        continue
+                    later = results[j]
+                    t = bisect_left(later.ends, token.end - bounds[j])
+                    if t < len(later) and later.ends[t] == token.end - bounds[j]:
+                        resync = j, t + 1, token.end
+            except EndOfFileException:
+                pass
+            buffer.lexical_errors.extend(sequential.errors)
+            if resync is None:
+                buffer.end_lineno = sequential.lineno
+                return buffer
+            k, begin, errors_from = resync
+
+    def _intern(self, lexeme: str) -> int:
+        lexeme_id = self._lexeme_table.get(lexeme)
+        if lexeme_id is None:
+            lexeme_id = self._lexeme_table[lexeme] = len(self.lexemes)
+            self.lexemes.append(lexeme)
+        return lexeme_id
+
+    def append(self, token: Token, lineno: int):
+        lexeme_id = self._intern(token.lexeme)
+        self.kinds.append(token.kind)
+        self.lexeme_ids.append(lexeme_id)
+        self.linenos.append(lineno)
+        self.starts.append(token.start)
+        self.ends.append(token.end)
+
+    def relex(self, text: str, edits: Iterable[Tuple[int, int, int]], fast_path=True) -> "TokenBuffer":
+        """Token buffer of ``text``, made by editing the source this buffer was lexed from.
+
+        Each edit is a ``(start, end, length)`` triple in the old source: the
+        characters in ``[start, end)`` were replaced by ``length`` new ones. The
+        scanner restarts after the last token whose lookahead lies before every
+        edit and stops as soon as one of its tokens ends where an old token
+        ended past the edits; from there the old tokens are reused with shifted
+        offsets and line numbers, and so are the lexical errors.
+        """
+        edits = list(edits)
+        buffer = TokenBuffer()
+        buffer.lexemes = list(self.lexemes)
+        buffer._lexeme_table = dict(self._lexeme_table)
+        if not edits:
+            buffer._extend(self, 0, len(self), 0, 0)
+            buffer.lexical_errors = list(self.lexical_errors)
+            buffer.end_lineno = self.end_lineno
+            return buffer
+        damage_start = min(start for start, _, _ in edits)
+        old_damage_end = max(end for _, end, _ in edits)
+        delta = sum(length - (end - start) for start, end, length in edits)
+
+        kept = bisect_left(self.ends, damage_start)
+        restart = self.ends[kept - 1] if kept else 0
+        buffer._extend(self, 0, kept, 0, 0)
+        buffer._extend_errors(self.lexical_errors, 0, restart, 0, 0)
+        scanner = _RecordingScanner(text, fast_path)
+        scanner.seek(restart)
+        try:
+            while True:
+                token = scanner.get_next_token()
+                buffer.append(token, scanner.lineno)
+                old_end = token.end - delta
+                if old_end < old_damage_end:
+                    continue
+                i = bisect_left(self.ends, old_end, kept)
+                if i < len(self) and self.ends[i] == old_end:
+                    line_delta = scanner.lineno - self.linenos[i]
+                    buffer.lexical_errors.extend(scanner.errors)
+                    buffer._extend(self, i + 1, len(self), delta, line_delta)
+                    buffer._extend_errors(self.lexical_errors, old_end, sys.maxsize, delta, line_delta)
+                    buffer.end_lineno = self.end_lineno + line_delta
+                    return buffer
+        except EndOfFileException:
+            pass
+        buffer.lexical_errors.extend(scanner.errors)
+        buffer.end_lineno = scanner.lineno
+        return buffer
+
+    def _extend(self, other: "TokenBuffer", begin: int, end: int, delta: int, line_delta: int,
+                lexeme_map: Optional[List[int]] = None):
+        """Append ``other``'s tokens ``[begin, end)`` moved by ``delta`` characters
+        and ``line_delta`` lines. ``lexeme_map`` translates ``other``'s lexeme ids;
+        without it they must already be valid here."""
+        self.kinds.extend(other.kinds[begin:end])
+        if lexeme_map is None:
+            self.lexeme_ids.extend(other.lexeme_ids[begin:end])
+        else:
+            self.lexeme_ids.extend(lexeme_map[lexeme_id] for lexeme_id in other.lexeme_ids[begin:end])
+        if delta == 0 and line_delta == 0:
+            self.linenos.extend(other.linenos[begin:end])
+            self.starts.extend(other.starts[begin:end])
+            self.ends.extend(other.ends[begin:end])
+            return
+        self.linenos.extend(lineno + line_delta for lineno in other.linenos[begin:end])
+        self.starts.extend(start + delta for start in other.starts[begin:end])
+        self.ends.extend(end + delta for end in other.ends[begin:end])
+
+    def _extend_errors(self, errors, begin: int, end: int, delta: int, line_delta: int):
+        """Append the errors starting in ``[begin, end)``, moved like in _extend."""
+        self.lexical_errors.extend(
+            (start + delta, lineno + line_delta, message)
+            for start, lineno, message in errors
+            if begin <= start < end
+        )
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i) -> Token:
+        kind = self.kinds[i]
+        return Token(
+            KIND_TOKEN_TYPES[kind],
+            kind,
+            None,
+            self.starts[i],
+            self.ends[i],
+            self.lexemes[self.lexeme_ids[i]],
+        )
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self[i]
+
+    def reader(self, scanner: Optional[Scanner] = None) -> "TokenBufferReader":
+        return TokenBufferReader(self, scanner)
+
+    def _arrays(self):
+        return self.kinds, self.lexeme_ids, self.linenos, self.starts, self.ends
+
+    def dump(self, stream: BinaryIO):
+        lexemes = "\n".join(self.lexemes).encode("utf-8")
+        stream.write(self._HEADER.pack(
+            self.MAGIC, self.VERSION, len(self), len(lexemes), len(self.lexical_errors), self.end_lineno
+        ))
+        stream.write(lexemes)
+        for start, lineno, message in self.lexical_errors:
+            message = message.encode("utf-8")
+            stream.write(self._ERROR.pack(start, lineno, len(message)))
+            stream.write(message)
+        for values in self._arrays():
+            if sys.byteorder == "big":
+                values = array(values.typecode, values)
+                values.byteswap()
+            stream.write(values.tobytes())
+
+    @classmethod
+    def load(cls, stream: BinaryIO) -> "TokenBuffer":
+        magic, version, count, lexemes_size, errors_count, end_lineno = cls._HEADER.unpack(
+            stream.read(cls._HEADER.size)
+        )
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("not a token buffer of this version")
+        buffer = cls()
+        buffer.end_lineno = end_lineno
+        lexemes = stream.read(lexemes_size).decode("utf-8")
+        buffer.lexemes = lexemes.split("\n") if lexemes_size else []
+        buffer._lexeme_table = {lexeme: i for i, lexeme in enumerate(buffer.lexemes)}
+        for _ in range(errors_count):
+            start, lineno, message_size = cls._ERROR.unpack(stream.read(cls._ERROR.size))
+            buffer.lexical_errors.append((start, lineno, stream.read(message_size).decode("utf-8")))
+        for values in buffer._arrays():
+            values.frombytes(stream.read(count * values.itemsize))
+            if sys.byteorder == "big":
+                values.byteswap()
+        return buffer
+
+
+class _RecordingScanner(Scanner):
+    """Scanner over a string that keeps its lexical errors as
+    ``(token start, line, message)`` and writes no symbol table."""
+
+    def __init__(self, text: str, fast_path=True):
+        self.errors = []
+        super().__init__(io.StringIO(text), None, None, fast_path)
+
+    def _write_to_errors(self, error_message, error_line):
+        self.errors.append((self.token_start, error_line, error_message))
+
+    def _write_to_symbol_table(self, symbol):
+        pass
+
+
+def _split_lines(text: str, chunk_size: int) -> List[int]:
+    """Chunk boundaries of ``text``, each one just after a newline."""
+    bounds = [0]
+    while True:
+        newline = text.find("\n", bounds[-1] + chunk_size - 1)
+        if newline < 0 or newline + 1 >= len(text):
+            break
+        bounds.append(newline + 1)
+    bounds.append(len(text))
+    return bounds
+
+
+class TokenBufferReader:
+    """Replays a TokenBuffer through the part of the Scanner interface the
+    parser and code generator use (``get_next_token`` and ``lineno``).
+
+    Given the scanner of the same source, it also writes the buffer's lexical
+    errors and new identifiers to that scanner as the tokens after them are
+    read, so its output files match a scanner driven by the parser directly.
+    """
+
+    def __init__(self, buffer: TokenBuffer, scanner: Optional[Scanner] = None):
+        self.buffer = buffer
+        self.scanner = scanner
+        self.index = 0
+        self.lineno = 1
+        self._errors_written = 0
+
+    def get_next_token(self) -> Token:
+        if self.index >= len(self.buffer):
+            self._write_errors(None)
+            self.lineno = self.buffer.end_lineno
+            raise EndOfFileException()
+        token = self.buffer[self.index]
+        if self.scanner is not None:
+            self._write_errors(token.start)
+            if token.token_type == TokenType.ID:
+                self.scanner.intern(token.lexeme)
+        self.lineno = self.buffer.linenos[self.index]
+        self.index += 1
+        return token
+
+    def _write_errors(self, before: Optional[int]):
+        if self.scanner is None:
+            return
+        errors = self.buffer.lexical_errors
+        while self._errors_written < len(errors):
+            start, lineno, message = errors[self._errors_written]
+            if before is not None and start >= before:
+                break
+            self.scanner._write_to_errors(message, lineno)
+            self._errors_written += 1
@@ -1,9 +1,23 @@
-from typing import List, Optional
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
 
-from consts import AddressType, SymbolDataType, SymbolType
+from consts import (
+    MODE_CONST,
+    MODE_DIRECT,
+    MODE_INDIRECT,
+    MODE_NONE,
+    OP_JP,
+    OP_JPF,
+    OPS,
+    AddressType,
+    SymbolDataType,
+    SymbolType,
+)
 
 
 class SymbolTableItem:
+    __slots__ = ("lexeme", "symbol_type", "scope", "size", "data_type", "address", "is_param")
+
     def __init__(
             self,
             scope: int,
@@ -24,27 +38,53 @@ class SymbolTableItem:
 
 
 class SymbolTable:
+    """Symbols in declaration order, indexed by lexeme.
+
+    ``items`` is the undo log of every declared symbol and ``by_lexeme`` keeps,
+    per lexeme, the stack of its shadowing declarations with the innermost on
+    top, so a lookup is a dict access and leaving a scope pops only its own
+    symbols. ``scope_starts`` holds the index in ``items`` at which each open
+    scope level began, so the symbols of a scope and its inner scopes are the
+    tail of ``items`` from there.
+    """
+
     def __init__(self) -> None:
         self.items: List[SymbolTableItem] = []
+        self.by_lexeme: Dict[Optional[str], List[SymbolTableItem]] = {}
+        self.scope_starts: Dict[int, int] = {}
+
+    def start_scope(self, scope):
+        self.scope_starts[scope] = len(self.items)
 
     def append(self, item: SymbolTableItem):
         self.items.append(item)
+        # a declaration cut short by a syntax error leaves a None behind
+        if item is not None:
+            self.by_lexeme.setdefault(item.lexeme, []).append(item)
 
     def pop(self):
-        self.items.pop()
+        item = self.items.pop()
+        if item is None:
+            return
+        shadowed = self.by_lexeme[item.lexeme]
+        shadowed.pop()
+        if not shadowed:
+            del self.by_lexeme[item.lexeme]
 
     def get_last_by_lexeme(self, lexeme) -> Optional[SymbolTableItem]:
-        items = list(filter(lambda x: x.lexeme == lexeme, self.items))
-        if len(items) == 0:
+        shadowed = self.by_lexeme.get(lexeme)
+        if not shadowed:
             return None
-        return items[-1]
+        return shadowed[-1]
 
-    def get_scope_symbols(self, scope) -> List[SymbolTableItem]:
-        return list(filter(lambda x: x.scope >= scope, self.items))
+    def get_scope_symbols(self, scope) -> range:
+        """Indices into ``items`` of the symbols of ``scope`` and the scopes
+        inside it, so they are not copied out."""
+        return range(self.scope_starts.get(scope, 0), len(self.items))
 
     def pop_last_scope(self, scope):
-        while len(self.items) != 0 and self.items[-1].scope == scope:
-            self.items.pop()
+        while len(self.items) != 0 and (self.items[-1] is None or self.items[-1].scope == scope):
+            self.pop()
 
 
 class FunctionDetails:
@@ -68,6 +108,23 @@ class FunctionDetails:
         self.return_address = return_address
         self.return_value_address = return_value_address
         self.scope = scope
+        self.call_sites: List[CallSiteDetails] = []
+        # locations handed out by CodeGenerator._get_temp while generating the body
+        self.temps: List[int] = []
+
+
+class CallSiteDetails:
+    def __init__(self, return_pb_idx, jp_pb_idx, resume_pb_idx, spills=None):
+        # the ASSIGN of the return address, the JP into the callee and the
+        # first instruction after the frame is restored
+        self.return_pb_idx = return_pb_idx
+        self.jp_pb_idx = jp_pb_idx
+        self.resume_pb_idx = resume_pb_idx
+        # (location, save pb idx, restore pb idx) per value kept on the runtime stack
+        if spills is None:
+            self.spills: List[Tuple[int, int, int]] = []
+        else:
+            self.spills = spills
 
 
 class LoopDetails:
@@ -84,26 +141,186 @@ class LoopDetails:
 
 
 class Address:
+    __slots__ = ("address", "address_type")
+
     def __init__(self, address: str, address_type: AddressType):
         self.address = address
         self.address_type = address_type
 
 
+def operand(mode: int, value: int = 0) -> int:
+    """An instruction operand packed as in consts."""
+    return value << 2 | mode
+
+
+def format_operand(packed: int) -> str:
+    mode = packed & 3
+    if mode == MODE_DIRECT:
+        return str(packed >> 2)
+    if mode == MODE_INDIRECT:
+        return f"@{packed >> 2}"
+    if mode == MODE_CONST:
+        return f"#{packed >> 2}"
+    return ""
+
+
 class Code:
-    def __init__(self, op, a, b=None, c=None):
+    """One instruction: an opcode from consts.OPS and up to three packed operands."""
+
+    __slots__ = ("op", "a", "b", "c")
+
+    def __init__(self, op: int, a: int, b: int = MODE_NONE, c: int = MODE_NONE):
         self.op = op
         self.a = a
         self.b = b
         self.c = c
 
     def __str__(self) -> str:
-        return f"({self.op}, {self.a}, {self._helper_str(self.b)}, {self._helper_str(self.c)})"
+        return f"({OPS[self.op]}, {format_operand(self.a)}, {format_operand(self.b)}, {format_operand(self.c)})"
+
+
+class ProgramBlock:
+    """Generated instructions kept as an opcode array and one array per
+    operand. Operands are only turned into text when the block is written.
+
+    Instructions are numbered from the start of the program, but ``flush``
+    writes out and drops the ones held so far: ``base`` is the number of the
+    first instruction still in memory, found at index ``i - base`` of the
+    arrays. A jump marked with ``defer`` is written with its target padded to
+    TARGET_WIDTH digits, so ``close`` can rewrite its line in place if it was
+    flushed before its target was known.
+    """
+
+    __slots__ = ("ops", "a", "b", "c", "base", "_deferred", "_fixups")
+
+    # lines collected before each write
+    WRITE_CHUNK = 4096
+    # digits of a deferred jump's target
+    TARGET_WIDTH = 10
+    # packed operands an int64 column can hold; the operand columns become
+    # plain lists once an integer literal too large for them is appended
+    PACKED_LIMIT = 1 << 63
+
+    def __init__(self):
+        self.ops = array('B')
+        self.a = array('q')
+        self.b = array('q')
+        self.c = array('q')
+        self.base = 0
+        self._deferred: Set[int] = set()
+        # flushed deferred jump -> (stream position of its line, instruction)
+        self._fixups: Dict[int, Tuple[int, Code]] = {}
+
+    def __len__(self):
+        return self.base + len(self.ops)
+
+    def append(self, code: Code):
+        if code.a >= self.PACKED_LIMIT or code.b >= self.PACKED_LIMIT or code.c >= self.PACKED_LIMIT:
+            self.a, self.b, self.c = list(self.a), list(self.b), list(self.c)
+        self.ops.append(code.op)
+        self.a.append(code.a)
+        self.b.append(code.b)
+        self.c.append(code.c)
+
+    def __getitem__(self, i: int) -> Code:
+        i -= self.base
+        return Code(self.ops[i], self.a[i], self.b[i], self.c[i])
+
+    def defer(self, i: int):
+        """Write the target of the JP or JPF numbered ``i`` at a fixed width."""
+        self._deferred.add(i)
+
+    def patch_jump(self, i: int, target: int):
+        """Set the packed ``target`` of the JP or JPF numbered ``i``, flushed or not."""
+        if i < self.base:
+            code = self._fixups[i][1]
+            if code.op == OP_JP:
+                code.a = target
+            else:
+                code.b = target
+            return
+        i -= self.base
+        if self.ops[i] == OP_JP:
+            self.a[i] = target
+        else:
+            self.b[i] = target
+
+    def delete(self, start: int, removed: Set[int]):
+        """Drop the instructions in ``removed``, all at or after ``start``, closing the gaps."""
+        offset = start - self.base
+        for column in (self.ops, self.a, self.b, self.c):
+            kept = [value for i, value in enumerate(column[offset:], start) if i not in removed]
+            column[offset:] = array(column.typecode, kept) if isinstance(column, array) else kept
+        self._deferred = {
+            i - sum(1 for j in removed if j < i) for i in self._deferred if i not in removed
+        }
+
+    def write(self, stream):
+        """Write the instructions held in memory one per line, numbered, in the
+        layout of Code.__str__."""
+        self._write(stream, False)
+
+    def flush(self, stream):
+        """Write the instructions held in memory and drop them, up to the first
+        jump whose target is not set, as one left by a syntax error, which
+        stays in memory with the code after it. ``stream`` must be seekable if
+        a deferred jump is written before it is patched."""
+        end = self._write(stream, True)
+        for column in (self.ops, self.a, self.b, self.c):
+            del column[:end - self.base]
+        self.base = end
+
+    def close(self, stream):
+        """Write the rest of a flushed block and rewrite the lines of the
+        deferred jumps patched since they were flushed."""
+        self._write(stream, False)
+        if not self._fixups:
+            return
+        for i, (position, code) in self._fixups.items():
+            stream.seek(position)
+            stream.write(self._deferred_line(i, code))
+        stream.seek(0, 2)
+        self._fixups.clear()
+
+    def _deferred_line(self, i: int, code: Code) -> str:
+        target = code.b if code.op == OP_JPF else code.a
+        target = f"{target >> 2:0{self.TARGET_WIDTH}d}"
+        if code.op == OP_JPF:
+            return f"{i}\t({OPS[code.op]}, {format_operand(code.a)}, {target}, )\n"
+        return f"{i}\t({OPS[code.op]}, {target}, , )\n"
 
-    @staticmethod
-    def _helper_str(a):
-        if a is None:
-            return ""
-        return a
+    def _write(self, stream, flushing: bool) -> int:
+        """Write the instructions held in memory, when ``flushing`` only those
+        ahead of the first unpatched jump that is not deferred, and return the
+        number of the first one not written."""
+        end = len(self)
+        formats = {}
+        out = []
+        deferred = self._deferred
+        for i, (op, a, b, c) in enumerate(zip(self.ops, self.a, self.b, self.c), self.base):
+            if i in deferred:
+                code = Code(op, a, b, c)
+                if flushing:
+                    stream.write("".join(out))
+                    out.clear()
+                    self._fixups[i] = (stream.tell(), code)
+                out.append(self._deferred_line(i, code))
+                continue
+            if flushing and (op == OP_JP and not a or op == OP_JPF and not b):
+                end = i
+                break
+            line = []
+            for packed in (a, b, c):
+                text = formats.get(packed)
+                if text is None:
+                    text = formats[packed] = format_operand(packed)
+                line.append(text)
+            out.append(f"{i}\t({OPS[op]}, {line[0]}, {line[1]}, {line[2]})\n")
+            if len(out) > self.WRITE_CHUNK:
+                stream.write("".join(out))
+                out.clear()
+        stream.write("".join(out))
+        return end
 
 
 class IfDetails: